@@ -0,0 +1,329 @@
+import json
+import operator
+import os
+import shutil
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype, take
+
+# Memory-mapped column files for tables too large to keep resident. Text columns
+# are fixed-width UTF-8 byte arrays, category columns are integer codes and small
+# integers are stored as is, so the OS pages in only the parts a query touches.
+# The same layout is the startup cache of resident tables, as it loads without
+# unpickling anything
+
+@register_extension_dtype
+class FixedWidthStringDtype(ExtensionDtype):
+    name = 'fixed_width_string'
+    type = str
+    kind = 'O'
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(self):
+        return FixedWidthStringArray
+
+# Text held as fixed-width UTF-8 bytes, usually a read-only memory map.
+# Missing values are stored as the empty string
+class FixedWidthStringArray(ExtensionArray):
+    def __init__(self, data: np.ndarray):
+        self._data = data
+
+    @classmethod
+    def _from_sequence(self, scalars, *, dtype = None, copy = False):
+        if isinstance(scalars, FixedWidthStringArray):
+            return scalars.copy() if copy else scalars
+        return FixedWidthStringArray(_encode(scalars))
+
+    @classmethod
+    def _from_factorized(self, values, original):
+        return FixedWidthStringArray(_encode(values))
+
+    @classmethod
+    def _concat_same_type(self, to_concat):
+        return FixedWidthStringArray(np.concatenate([array._data for array in to_concat]))
+
+    @property
+    def dtype(self) -> FixedWidthStringDtype:
+        return FixedWidthStringDtype()
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __getitem__(self, item):
+        if pd.api.types.is_integer(item):
+            value = self._data[item]
+            return value.decode('utf-8') if value else np.nan
+        item = pd.api.indexers.check_array_indexer(self, item)
+        return FixedWidthStringArray(self._data[item])
+
+    def __array__(self, dtype = None, copy = None):
+        return self._decoded() if dtype is None else self._decoded().astype(dtype)
+
+    def as_bytes(self) -> np.ndarray:
+        # The stored bytes, which sort in the same order as the text
+        return self._data
+
+    def _decoded(self) -> np.ndarray:
+        decoded = np.char.decode(self._data, 'utf-8').astype(object)
+        decoded[self.isna()] = np.nan
+        return decoded
+
+    def isna(self) -> np.ndarray:
+        return self._data == b''
+
+    def take(self, indices, allow_fill = False, fill_value = None):
+        # Reads only the requested rows, so only their pages of the map are touched
+        if allow_fill:
+            return FixedWidthStringArray(take(self._data, indices, allow_fill = True, fill_value = b''))
+        return FixedWidthStringArray(self._data.take(indices))
+
+    def copy(self):
+        return FixedWidthStringArray(np.array(self._data))
+
+    def astype(self, dtype, copy = True):
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, FixedWidthStringDtype):
+            return self.copy() if copy else self
+        if isinstance(dtype, ExtensionDtype):
+            return pd.array(self._decoded(), dtype = dtype)
+        return self._decoded().astype(dtype)
+
+    def isin(self, values) -> np.ndarray:
+        return np.isin(self._data, _encode(values))
+
+    def _values_for_argsort(self) -> np.ndarray:
+        return self._data
+
+    def _values_for_factorize(self):
+        return self._decoded(), np.nan
+
+    def _compare(self, other, op) -> np.ndarray:
+        if isinstance(other, (pd.Series, pd.Index)):
+            return NotImplemented
+        if isinstance(other, FixedWidthStringArray):
+            result = op(self._data, other._data)
+            missing = self.isna() | other.isna()
+        elif isinstance(other, str):
+            result = op(self._data, other.encode('utf-8'))
+            missing = self.isna()
+        else:
+            return op(self._decoded(), other)
+        # As with pandas strings, missing values only ever differ
+        return np.where(missing, op is operator.ne, result)
+
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+def _encode(values) -> np.ndarray:
+    text = ['' if pd.isna(value) else str(value) for value in values]
+    encoded = np.array([value.encode('utf-8') for value in text], dtype = bytes)
+    return encoded if len(encoded) else np.empty(0, dtype = 'S1')
+
+def _code_dtype(count: int):
+    for dtype in (np.int8, np.int16, np.int32):
+        if count < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+# read_csv options for the table files: only an empty field is missing, so text such as 'NA' or 'null' is kept
+CSV_NA = {'keep_default_na' : False, 'na_values' : ['']}
+
+def narrow(values: pd.Series, dtype) -> pd.Series:
+    # Casts a column read as text to its declared dtype, or leaves it as text if any value would be lost
+    if dtype == 'category':
+        return values.astype('category')
+    if dtype == 'Int8':
+        numbers = pd.to_numeric(values, errors = 'coerce')
+        present = values.notna().to_numpy()
+        limits = np.iinfo(np.int8)
+        fits = numbers.notna() & (numbers % 1 == 0) & numbers.between(limits.min, limits.max)
+        if fits.to_numpy()[present].all():
+            return numbers.astype('Int8')
+    return values
+
+def _kind_of(dtype) -> str:
+    if dtype == 'category':
+        return 'codes'
+    if dtype == 'Int8':
+        return 'int'
+    return 'text'
+
+def build_columns(csv_path: Path, columns_path: Path, dtypes: dict, signature, primary_key: str,
+                  chunk_size: int, progress: Callable[[float], None] = None):
+    # Two passes over the CSV, a chunk at a time: the first sizes the text columns and
+    # collects the categories, the second writes every column into its own file
+    read_dtypes = {column : 'str' for column in dtypes}
+    def chunks():
+        with open(csv_path, 'rb') as f:
+            for chunk in pd.read_csv(f, dtype = read_dtypes or None, chunksize = chunk_size, **CSV_NA):
+                if primary_key in chunk.columns and pd.api.types.is_string_dtype(chunk[primary_key]):
+                    chunk[primary_key] = chunk[primary_key].str.strip()
+                yield chunk, f.tell()
+
+    size = max(csv_path.stat().st_size, 1)
+    names = pd.read_csv(csv_path, nrows = 0).columns.tolist()
+    kinds = {name : _kind_of(dtypes.get(name, 'str')) for name in names}
+    widths = {name : 1 for name in names}
+    categories = {name : set() for name in names}
+    rows = 0
+    for chunk, position in chunks():
+        rows += len(chunk)
+        for name in names:
+            if kinds[name] == 'int' and narrow(chunk[name], 'Int8').dtype != 'Int8':
+                kinds[name] = 'text' # A value that doesn't fit keeps the whole column as text
+            if kinds[name] in ('text', 'int'):
+                widths[name] = max(widths[name], int(chunk[name].astype('str').str.encode('utf-8').str.len().max(skipna = True) or 0))
+            elif kinds[name] == 'codes':
+                categories[name].update(chunk[name].dropna().unique().tolist())
+        if progress is not None:
+            progress(0.5 * position / size)
+
+    manifest = {'signature' : signature, 'rows' : rows, 'columns' : []}
+    for name in names:
+        column = {'name' : name, 'kind' : kinds[name]}
+        if kinds[name] == 'codes':
+            column['categories'] = sorted(categories[name])
+        manifest['columns'].append(column)
+
+    building_path = columns_path.with_name(columns_path.name + '.tmp')
+    _remove(building_path)
+    building_path.mkdir()
+    files = {}
+    for position, column in enumerate(manifest['columns']):
+        name = column['name']
+        match column['kind']:
+            case 'text':
+                files[name] = [np.lib.format.open_memmap(building_path / f'{position}.npy', mode = 'w+', dtype = f'S{widths[name]}', shape = (rows,))]
+            case 'codes':
+                files[name] = [np.lib.format.open_memmap(building_path / f'{position}.npy', mode = 'w+', dtype = _code_dtype(len(column['categories'])), shape = (rows,))]
+            case 'int':
+                files[name] = [np.lib.format.open_memmap(building_path / f'{position}.npy', mode = 'w+', dtype = np.int8, shape = (rows,)),
+                               np.lib.format.open_memmap(building_path / f'{position}.mask.npy', mode = 'w+', dtype = bool, shape = (rows,))]
+    start = 0
+    for chunk, position in chunks():
+        end = start + len(chunk)
+        for column in manifest['columns']:
+            name = column['name']
+            values = chunk[name]
+            match column['kind']:
+                case 'text':
+                    files[name][0][start:end] = _encode(values.tolist())
+                case 'codes':
+                    files[name][0][start:end] = pd.Categorical(values, categories = column['categories']).codes
+                case 'int':
+                    values = narrow(values, 'Int8')
+                    files[name][0][start:end] = values.to_numpy(dtype = np.int8, na_value = 0)
+                    files[name][1][start:end] = values.isna().to_numpy()
+        start = end
+        if progress is not None:
+            progress(0.5 + 0.5 * position / size)
+    for arrays in files.values():
+        for array in arrays:
+            array.flush()
+    del files
+    _publish(building_path, columns_path, manifest)
+
+def write_frame(df: pd.DataFrame, columns_path: Path, signature) -> bool:
+    # Saves a resident frame as column files. Returns False if a column has a type the layout can't hold
+    manifest = {'signature' : signature, 'rows' : len(df), 'columns' : []}
+    arrays = []
+    for name in df.columns:
+        values = df[name]
+        column = {'name' : name}
+        if isinstance(values.dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(values.cat.categories.dtype):
+            column['kind'] = 'codes'
+            column['categories'] = values.cat.categories.tolist()
+            arrays.append([values.cat.codes.to_numpy()])
+        elif values.dtype == 'Int8':
+            column['kind'] = 'int'
+            arrays.append([values.to_numpy(dtype = np.int8, na_value = 0), values.isna().to_numpy()])
+        elif pd.api.types.is_string_dtype(values.dtype) and values.dtype != object:
+            # Packed into one NUL-separated UTF-8 buffer, which decodes and splits far faster than fixed-width bytes
+            column['kind'] = 'packed'
+            packed = '\0'.join(values.fillna('').tolist())
+            if packed.count('\0') != max(len(values) - 1, 0):
+                return False # a value contains the separator
+            arrays.append([np.frombuffer(packed.encode('utf-8'), dtype = np.uint8), values.isna().to_numpy()])
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf':
+            column['kind'] = 'array'
+            arrays.append([values.to_numpy()])
+        else:
+            return False
+        manifest['columns'].append(column)
+
+    building_path = columns_path.with_name(columns_path.name + '.tmp')
+    _remove(building_path)
+    building_path.mkdir()
+    for position, files in enumerate(arrays):
+        for suffix, data in zip(('', '.mask'), files):
+            np.save(building_path / f'{position}{suffix}.npy', data, allow_pickle = False)
+    _publish(building_path, columns_path, manifest)
+    return True
+
+def _remove(path: Path):
+    # Clears whatever is at the path, including a file left by an older version
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors = True)
+    else:
+        path.unlink(missing_ok = True)
+
+def _publish(building_path: Path, columns_path: Path, manifest: dict):
+    # The manifest is written last and the directory swapped in whole, so readers never see a partial set
+    with open(building_path / 'manifest.json', 'w', encoding = 'utf-8') as f:
+        json.dump(manifest, f, ensure_ascii = False)
+    _remove(columns_path)
+    os.replace(building_path, columns_path)
+
+def read_manifest(columns_path: Path) -> dict:
+    try:
+        with open(columns_path / 'manifest.json', encoding = 'utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def open_columns(columns_path: Path, manifest: dict, mapped: bool = True) -> pd.DataFrame:
+    # When mapped nothing is read here: every column is a read-only map of its file.
+    # Otherwise the columns are read into memory, with text decoded to regular strings
+    mode = 'r' if mapped and manifest['rows'] > 0 else None # an empty array has nothing to map
+    columns = {}
+    for position, column in enumerate(manifest['columns']):
+        name = column['name']
+        data = np.load(columns_path / f'{position}.npy', mmap_mode = mode)
+        match column['kind']:
+            case 'text':
+                array = FixedWidthStringArray(data) if mapped else FixedWidthStringArray(data).astype('str')
+            case 'codes':
+                array = pd.Categorical.from_codes(data, dtype = pd.CategoricalDtype(column['categories']))
+            case 'int':
+                array = pd.arrays.IntegerArray(data, np.load(columns_path / f'{position}.mask.npy', mmap_mode = mode))
+            case 'packed':
+                values = np.array(data.tobytes().decode('utf-8').split('\0') if manifest['rows'] > 0 else [], dtype = object)
+                values[np.load(columns_path / f'{position}.mask.npy')] = np.nan
+                array = pd.array(values, dtype = 'str')
+            case 'array':
+                array = data
+        columns[name] = pd.Series(array, copy = False)
+    return pd.DataFrame(columns, copy = False)
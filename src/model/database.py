@@ -1,18 +1,38 @@
+import json
+import os
+import shutil
 import sys
-from dataclasses import dataclass
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
-from typing import Union, Callable, Optional, Iterator, List
+from typing import Any, Union, Callable, Optional, Iterator, List, Tuple
+import numpy as np
 import pandas as pd
 
 from src.model.errors import ArgumentError, DatabaseError, DatabaseErrorKind
+from src.model.journal import Journal
+from src.model.columnar import CSV_NA, FixedWidthStringArray, build_columns, narrow, open_columns, read_manifest, write_frame
 from src.model.entries import *
+from src.model.predicates import *
 
 class ConstraintAction(Enum):
     Cascade  = 0 # automatically updates/deletes related records when the referenced record is updated/deleted
     SetNull  = 1 # sets the value to null (or a default) when the related record is deleted/updated
     Restrict = 2 # prevents the change and raises an error
 
+class Storage(Enum):
+    Resident = 0 # the whole table is a pandas frame in memory, journaled and writable
+    Mapped   = 1 # read-only; each column is a memory-mapped file the OS pages in as queries touch it
+
+class ImportMode(Enum):
+    Append  = 0 # adds the imported rows, rejecting keys that already exist
+    Upsert  = 1 # updates rows whose key already exists and adds the rest
+    Replace = 2 # the imported rows become the whole table
+
 @dataclass
 class Sorted:
     column: str
@@ -22,125 +42,695 @@ class Sorted:
     def By(column: str, ascending: bool = True):
         return Sorted(column, ascending)
 
+@dataclass(frozen = True)
+class Cursor:
+    value: Any # sort column value of the last row shown
+    key: Optional[str] # primary key of the last row shown, which breaks ties in the sort column
+
+    # Marks the position before the first row
+    @staticmethod
+    def Start():
+        return Cursor(None, None)
+
+    # Marks the position just after 'record' in an order sorted by 'column'
+    @staticmethod
+    def Of(record: dict, column: str, key_column: str):
+        return Cursor(record[column], record[key_column])
+
 @dataclass
 class Paged:
     size: int
     index: Optional[int] = None
+    cursor: Optional[Cursor] = None
 
     # Requests a list that yields specific page of 'size' records
     @staticmethod
     def Specific(index: int, size: int):
         return Paged(size=size, index=index)
 
+    # Requests the 'size' records that follow 'cursor' in the sort order, or the first page if None.
+    # Rows added or removed before the cursor do not shift the page, and a deep page costs as much as the first
+    @staticmethod
+    def After(cursor: Optional[Cursor], size: int):
+        return Paged(size=size, cursor=cursor if cursor is not None else Cursor.Start())
+
     # Requests a generator that yields pages of 'size' records each
     @staticmethod
     def Stream(size: int):
         return Paged(size=size, index=None)
 
+@dataclass(frozen = True)
+class Search:
+    text: str
+    column: Optional[str] = None
+
+    # Requests rows containing 'text' (case-insensitive) in 'column', or in any column if None
+    @staticmethod
+    def For(text: str, column: Optional[str] = None):
+        return Search(text, column)
+
+@dataclass
+class SaveStats:
+    mode: str # 'skipped', 'append' (only new rows were serialized) or 'rewrite'
+    rows_written: int = 0
+    bytes_written: int = 0 # to disk, including the existing bytes an append copies
+    seconds: float = 0.0
+
+@dataclass
+class ImportReport:
+    mode: ImportMode
+    rows_read: int = 0
+    inserted: int = 0
+    updated: int = 0
+    rejected: pd.DataFrame = None # rejected rows with their CSV line number and the reason
+    cascaded: dict[EntryKind, int] = None # rows deleted (or set to null) in other tables for keys a Replace dropped
+    seconds: float = 0.0
+
+    @property
+    def accepted(self) -> int:
+        return self.inserted + self.updated
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_read / self.seconds if self.seconds > 0 else 0.0
+
+@dataclass
+class IntegrityReport:
+    dangling_program_codes: dict[str, int] # missing program code -> number of students using it
+    dangling_college_codes: dict[str, int] # missing college code -> number of programs using it
+    duplicate_keys: dict[EntryKind, List[str]]
+    malformed_ids: List[str]
+    repaired: dict[EntryKind, int] = None # rows deleted or changed in each table, if repaired
+    seconds: float = 0.0
+
+    def is_clean(self) -> bool:
+        return not (self.dangling_program_codes or self.dangling_college_codes or self.malformed_ids
+                    or any(self.duplicate_keys.values()))
+
+# What a batch needs to commit or roll back its writes
+@dataclass
+class _BatchState:
+    frame: pd.DataFrame
+    tracking: tuple
+    modified: bool
+    validate: Optional[Callable] = None
+    log: list = field(default_factory = list) # journal entries written on commit
+    added_keys: dict = field(default_factory = dict) # keys of rows added during the batch (as an ordered set), validated together on commit
+    compact_requested: bool = False # compaction waits for the commit, so uncommitted rows never reach the CSV
+
+def _dtype_of(field: FieldInfo):
+    # Maps the entry field metadata onto a compact pandas dtype. Columns are only
+    # narrowed to it on load if every value in the file fits (see narrow())
+    if isinstance(field.underlying_type, type) and issubclass(field.underlying_type, Enum):
+        return 'category' # Categories come from the file, so values outside the enum are kept
+    if field.underlying_type is int:
+        return 'Int8' # Integer fields are small codes such as the year level
+    if field.categorical:
+        return 'category'
+    return 'str'
+
 # Generic CSV Database with CRUD operations and query capabilities
 class GenericDatabase:
-    def __init__(self, file_path: Path, primary_key: str = None):
+    # Added rows are staged and merged into the frame with a single concat,
+    # either on the next read or once this many rows are waiting
+    APPEND_BUFFER_SIZE = 1024
+    # Number of filtered and sorted results kept by query()
+    QUERY_CACHE_SIZE = 32
+    # Journal entries after which the journal is folded into the CSV in the background
+    JOURNAL_COMPACT_THRESHOLD = 500
+    # Rows parsed between progress reports while loading a CSV
+    LOAD_CHUNK_SIZE = 100_000
+    # Rows validated at a time by import_csv()
+    IMPORT_CHUNK_SIZE = 50_000
+
+    def __init__(self, file_path: Path, primary_key: str = None, journaled: bool = True, schema: dict[str, FieldInfo] = None, indexed: List[str] = None, storage: Storage = Storage.Resident):
         self.file_path = file_path
+        self.storage = storage
         self.modified = False
+        self._dtypes = {name : _dtype_of(field) for name, field in schema.items()} if schema else {}
+        # Every write is appended to the journal so it survives a crash before save()
+        self._journal = Journal(file_path) if journaled and storage == Storage.Resident else None
+        self._replaying = False
+        self._compaction = None
+        # (error or None, generation) recorded by the last background compaction
+        self._compaction_result = None
+        # Set when a compaction failed after the tracking below was reset, so the CSV may be missing rows
+        self._rewrite_required = False
+        # Keys of rows inserted, updated or deleted since the CSV was last written
+        self._inserted = set()
+        self._updated = set()
+        self._deleted = set()
+        self.last_save_stats = None
+        self._pending = []
+        # Lowercased UTF-8 column arrays used by search(), keyed by column (None = all fields)
+        self._search_arrays = {}
+        # (column, needle, matched positions) of the last search, reused while the text only grows
+        self._last_search = None
+        # Bumped on every write so cached results from an older table state never match
+        self.generation = 0
+        self._query_cache = OrderedDict()
+        # Row positions of the whole table in sorted order, keyed by (column, ascending)
+        self._sort_cache = {}
+        # Sorted key positions used to binary search the keys of a mapped table
+        self._key_order = None
 
-        if not file_path.exists():
-            self.df = pd.DataFrame()
-        else:
+        # Parsed, typed copy of the CSV as column files, reused while the CSV is unchanged
+        self.cache_path = file_path.with_name(file_path.name + '.cache')
+        # Column files a mapped table is read from, rebuilt whenever the CSV changes
+        self.columns_path = file_path.with_name(file_path.name + '.columns')
+        self.primary_key = primary_key
+
+        # The CSV is parsed on first access (or by load()), not on construction
+        self._df = None
+        self._loaded = False
+        self._loading = False
+        self._load_lock = threading.RLock()
+
+        # Maps each primary key to its row position for O(1) key lookups
+        self._key_positions = {}
+        self._key_index_stale = False
+        # Reverse indexes of the indexed columns (e.g. foreign keys), value -> row positions.
+        # Built on the first lookup, kept up to date on inserts and updates, dropped on deletes
+        self._indexed = list(indexed) if indexed else []
+        self._column_indexes = {}
+        self._batch = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, progress: Callable[[float], None] = None):
+        # Other threads wait here until loading is done; the replay below re-enters on the loading thread
+        with self._load_lock:
+            if self._loaded or self._loading:
+                return
+            self._loading = True
+            try:
+                self._df = self._load_frame(progress)
+                if not self.primary_key:
+                    self.primary_key = self._df.columns[0] if not self._df.empty else None
+                if self.storage == Storage.Mapped:
+                    # Keys are found by binary search, so a dict of every key is only built if something asks for it
+                    self._key_index_stale = True
+                else:
+                    self._rebuild_key_index()
+                if self._journal is not None:
+                    self._replay_journal()
+                self._loaded = True
+                if progress is not None:
+                    progress(1.0)
+            finally:
+                self._loading = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _cache_signature(self) -> list:
+        # Kept in a JSON manifest, so it is built in the form it reads back as
+        stat = self.file_path.stat()
+        return json.loads(json.dumps([stat.st_size, stat.st_mtime_ns, pd.__version__, np.__version__,
+                                      [[name, str(dtype)] for name, dtype in self._dtypes.items()]]))
+
+    def _load_frame(self, progress: Callable[[float], None] = None) -> pd.DataFrame:
+        if not self.file_path.exists():
+            return pd.DataFrame()
+        signature = self._cache_signature()
+        if self.storage == Storage.Mapped:
+            return self._map_columns(signature, progress)
+        manifest = read_manifest(self.cache_path)
+        if manifest is not None and manifest['signature'] == signature:
+            try:
+                return open_columns(self.cache_path, manifest, mapped = False)
+            except Exception:
+                pass # An unreadable cache is simply rebuilt from the CSV
+        try:
+            df = self._read_csv(progress) if progress is not None else self._narrow(pd.read_csv(str(self.file_path), dtype = self._read_dtypes() or None, **CSV_NA))
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+        if self.primary_key in df.columns and pd.api.types.is_string_dtype(df[self.primary_key]):
+            # Keys are stripped once here rather than on every index rebuild
+            df[self.primary_key] = df[self.primary_key].str.strip()
+        self._write_cache(df)
+        return df
+
+    def _map_columns(self, signature: list, progress: Callable[[float], None] = None) -> pd.DataFrame:
+        manifest = read_manifest(self.columns_path)
+        if manifest is None or manifest['signature'] != signature:
             try:
-                self.df = pd.read_csv(str(file_path))
+                build_columns(self.file_path, self.columns_path, self._dtypes, signature, self.primary_key,
+                              self.LOAD_CHUNK_SIZE, progress)
             except pd.errors.EmptyDataError:
-                self.df = pd.DataFrame()
+                return pd.DataFrame()
+            manifest = read_manifest(self.columns_path)
+        return open_columns(self.columns_path, manifest)
+
+    def _read_dtypes(self) -> dict:
+        # Declared columns are read as text and narrowed afterwards, so a value that doesn't fit is kept rather than lost
+        return {column : 'str' for column in self._dtypes}
+
+    def _narrow(self, df: pd.DataFrame) -> pd.DataFrame:
+        for column, dtype in self._dtypes.items():
+            if column in df.columns:
+                df[column] = narrow(df[column], dtype)
+        return df
+
+    def _read_csv(self, progress: Callable[[float], None]) -> pd.DataFrame:
+        size = max(self.file_path.stat().st_size, 1)
+        chunks = []
+        with open(self.file_path, 'rb') as f:
+            for chunk in pd.read_csv(f, dtype = self._read_dtypes() or None, chunksize = self.LOAD_CHUNK_SIZE, **CSV_NA):
+                chunks.append(chunk)
+                progress(min(f.tell() / size, 1.0))
+        # Narrowed once over the whole file, so every chunk ends up with the same dtypes
+        return self._narrow(pd.concat(chunks, ignore_index = True))
+
+    def _write_cache(self, df: pd.DataFrame):
+        # The CSV stays the source of truth; failing to write the cache only costs a slower start
+        try:
+            write_frame(self._as_parsed(df), self.cache_path, self._cache_signature())
+        except (OSError, ValueError):
+            pass
+
+    def _as_parsed(self, df: pd.DataFrame) -> pd.DataFrame:
+        # The frame as reading back its CSV would give it, so a cached start sees the same values:
+        # empty text is missing, keys are stripped and a text column is narrowed again if it now fits
+        df = df.copy(deep = False)
+        for column in df.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                if '' in values.cat.categories:
+                    df[column] = values.cat.remove_categories([''])
+            elif pd.api.types.is_string_dtype(values.dtype) and values.dtype != object:
+                values = values.mask((values == '').to_numpy(dtype = bool))
+                if column == self.primary_key:
+                    values = values.str.strip()
+                df[column] = narrow(values, self._dtypes.get(column))
+        return df
+
+    @staticmethod
+    def _normalize_key(key) -> str:
+        return str(key).strip()
+
+    @property
+    def _key_index(self) -> dict:
+        # Rebuilt on first use after rows shift, so several deletes in a row pay for one rebuild
+        if self._key_index_stale:
+            self._rebuild_key_index()
+        return self._key_positions
+
+    def _rebuild_key_index(self):
+        self._key_index_stale = False
+        if not self.primary_key or self.df.empty or self.primary_key not in self.df.columns:
+            self._key_positions = {}
+            return
+        keys = self.df[self.primary_key]
+        if not pd.api.types.is_string_dtype(keys):
+            keys = keys.astype(str)
+        keys = keys.tolist()
+        # Filled back to front so a duplicated key keeps its first position, like a filtered lookup would
+        self._key_positions = dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+
+    def _find_key(self, key: str) -> Optional[int]:
+        keys = self.df[self.primary_key].array if self.primary_key in self.df.columns else None
+        if not isinstance(keys, FixedWidthStringArray):
+            return self._key_index.get(self._normalize_key(key))
+        # A mapped key column is binary searched through its sort order, touching a few of its pages
+        if self._key_order is None:
+            order = self._sort_permutation(self.primary_key, True)
+            # Missing keys are sorted last and would break the search
+            self._key_order = order[:len(order) - int(keys.isna().sum())]
+        data = keys.as_bytes()
+        needle = self._normalize_key(key).encode('utf-8')
+        i = int(np.searchsorted(data, needle, sorter = self._key_order))
+        if i < len(self._key_order) and data[self._key_order[i]] == needle:
+            return int(self._key_order[i])
+        return None
+
+    def _check_writable(self):
+        if self.storage == Storage.Mapped:
+            raise DatabaseError(DatabaseErrorKind.READ_ONLY,
+                                f'\'{self.file_path.name}\' is memory-mapped and cannot be changed')
+
+    def _locate(self, key: str) -> int:
+        self._ensure_loaded()
+        if not self.primary_key:
+            raise DatabaseError(DatabaseErrorKind.UNDEFINED_PRIMARY_KEY)
+        pos = self._find_key(key)
+        if pos is None:
+            raise DatabaseError(DatabaseErrorKind.NO_KEY, 
+                                f'An entry with key \'{key}\' does not exist')
+        return pos
+
+    @property
+    def df(self) -> pd.DataFrame:
+        self._ensure_loaded()
+        if self._pending:
+            self._flush_pending()
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame):
+        self._df = value
+
+    def _flush_pending(self):
+        staged = pd.DataFrame(self._pending)
+        self._pending = []
+        self._append_frame(staged)
+
+    def _append_frame(self, staged: pd.DataFrame):
+        if self._df.empty and len(self._df.columns) == 0:
+            self._df = self._conform(staged, {column : dtype for column, dtype in self._dtypes.items() if column in staged.columns})
+        else:
+            staged = self._conform(staged, {column : self._df[column].dtype for column in staged.columns if column in self._df.columns})
+            self._df = pd.concat([self._df, staged], ignore_index = True)
+
+    def _conform(self, staged: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+        # Casts staged rows to the table's dtypes so concatenating them keeps the compact types
+        for column, dtype in dtypes.items():
+            if column in self._df.columns:
+                # The loaded column may have stayed text, so rows follow its dtype rather than the declared one
+                self._admit_values(column, staged[column].tolist())
+                dtype = self._df[column].dtype
+            try:
+                staged[column] = staged[column].astype(dtype)
+            except (TypeError, ValueError):
+                pass
+        return staged
+
+    def _admit_values(self, column: str, values: list):
+        # Categorical columns only accept known categories, so new values are registered first
+        series = self._df[column]
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            return
+        new_values = [value for value in dict.fromkeys(values) if not pd.isna(value) and value not in series.cat.categories]
+        if new_values:
+            self._df[column] = series.cat.add_categories(new_values)
+
+    def _row_count(self) -> int:
+        self._ensure_loaded()
+        return len(self._df) + len(self._pending)
+
+    def _invalidate_caches(self):
+        # Derived arrays are rebuilt lazily on the next read
+        self._search_arrays.clear()
+        self._last_search = None
+        self._query_cache.clear()
+        self._sort_cache.clear()
+        self._key_order = None
+
+    def _mark_modified(self):
+        self.generation += 1
+        self._invalidate_caches()
+        self.modified = True
+
+    def _search_array(self, column: Optional[str]) -> np.ndarray:
+        array = self._search_arrays.get(column)
+        if array is None:
+            if column is None:
+                lowered = [self.df[col].astype(str).str.lower() for col in self.df.columns]
+                # The separator keeps a match from spanning two adjacent fields
+                text = lowered[0].str.cat(lowered[1:], sep = '\x1f') if lowered else pd.Series(dtype = str)
+            else:
+                text = self.df[column].astype(str).str.lower()
+            array = np.array(text.str.encode('utf-8').to_numpy(), dtype = bytes)
+            self._search_arrays[column] = array
+        return array
+
+    def search(self, text: str, column: Optional[str] = None) -> np.ndarray:
+        # Returns the row positions whose 'column' (or any column) contains 'text', ignoring case
+        if column is not None and column not in self.df.columns:
+            raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
+                                f'Column \'{column}\' does not exist for searching')
+        if not text or self.df.empty:
+            return np.arange(len(self.df))
+        needle = text.lower().encode('utf-8')
+        array = self._search_array(column)
+        if self._last_search is not None:
+            last_column, last_needle, last_positions = self._last_search
+            # Any row containing the new text also contains the previous text
+            if last_column == column and last_needle in needle:
+                positions = last_positions[np.char.find(array[last_positions], needle) >= 0]
+                self._last_search = (column, needle, positions)
+                return positions
+        positions = np.flatnonzero(np.char.find(array, needle) >= 0)
+        self._last_search = (column, needle, positions)
+        return positions
+
+    def search_prefix(self, text: str, column: str) -> np.ndarray:
+        # Returns the row positions whose 'column' starts with 'text', ignoring case
+        if column not in self.df.columns:
+            raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
+                                f'Column \'{column}\' does not exist for searching')
+        if not text or self.df.empty:
+            return np.arange(len(self.df))
+        return np.flatnonzero(np.char.startswith(self._search_array(column), text.lower().encode('utf-8')))
+
+    def _select(self, where: Union[str, Callable, Search, Predicate], sorted: Optional[Sorted]) -> np.ndarray:
+        # Evaluates the filter and sort once, yielding the matching row positions in order
+        if where is None:
+            positions = np.arange(len(self.df))
+        elif isinstance(where, Search):
+            positions = self.search(where.text, where.column)
+        elif isinstance(where, Predicate):
+            positions = np.flatnonzero(where.mask(self))
+        elif isinstance(where, str):
+            positions = np.flatnonzero(self._string_mask(where))
+        elif callable(where):
+            positions = np.flatnonzero(self.df.apply(where, axis = 1).to_numpy(dtype = bool))
+        else:
+            positions = np.arange(len(self.df))
+        if sorted is not None:
+            if sorted.column not in self.df.columns:
+                raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
+                                    f'Column \'{sorted.column}\' does not exist for sorting')
+            order = self._sort_permutation(sorted.column, sorted.ascending)
+            if where is None:
+                positions = order
+            else:
+                # Keep the cached order, restricted to the rows that passed the filter
+                selected = np.zeros(len(self.df), dtype = bool)
+                selected[positions] = True
+                positions = order[selected[order]]
+        return positions
+
+    def _sort_values(self, column: str) -> pd.Series:
+        values = self.df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Categories are kept in insertion order, so sort by the values themselves
+            values = values.astype(values.cat.categories.dtype)
+        return values
+
+    def _sort_codes(self, column: str) -> np.ndarray:
+        # Dense ranks of the column's values, -1 where missing; sorting integers is far cheaper than sorting strings
+        values = self._sort_values(column)
+        if isinstance(values.array, FixedWidthStringArray):
+            missing = values.isna().to_numpy()
+            text = values.array.as_bytes()
+        elif not pd.api.types.is_string_dtype(values.dtype):
+            return pd.factorize(values, sort = True)[0]
+        else:
+            missing = values.isna().to_numpy()
+            text = values.to_numpy(dtype = object, na_value = '').astype(str)
+        order = np.argsort(text, kind = 'stable')
+        ordered = text[order]
+        codes = np.empty(len(text), dtype = np.intp)
+        codes[order] = np.concatenate(([0], np.cumsum(ordered[1:] != ordered[:-1]))) if len(text) else []
+        codes[missing] = -1
+        return codes
+
+    def _sort_permutation(self, column: str, ascending: bool) -> np.ndarray:
+        order = self._sort_cache.get((column, ascending))
+        if order is None:
+            codes = self._sort_codes(column)
+            # Missing values go last in both directions
+            codes = np.where(codes < 0, len(codes), codes) if ascending else -codes
+            if self.primary_key and column != self.primary_key:
+                # Ties are broken by the primary key, so every row has a fixed place a cursor can resume from
+                by_key = self._sort_permutation(self.primary_key, True)
+                order = by_key[np.argsort(codes[by_key], kind = 'stable')]
+            else:
+                order = np.argsort(codes, kind = 'stable')
+            self._sort_cache[(column, ascending)] = order
+        return order
+
+    def _cursor_start(self, positions: np.ndarray, sorted: Sorted, cursor: Cursor) -> int:
+        # Index into 'positions', which are in sorted order, of the first row after the cursor.
+        # The binary search reads only the rows it compares, so no sorted copy of the column is kept
+        if cursor == Cursor.Start():
+            return 0
+        values = self.df[sorted.column]
+        keys = self.df[self.primary_key] if self.primary_key else None
+        cursor_missing = pd.isna(cursor.value)
+
+        def shown(position) -> bool:
+            # Whether the row comes at or before the cursor: missing values are last and ties go by key
+            value = values.iat[position]
+            missing = pd.isna(value)
+            if missing != cursor_missing:
+                return cursor_missing
+            if missing or value == cursor.value:
+                return keys is None or keys.iat[position] <= cursor.key
+            return value < cursor.value if sorted.ascending else value > cursor.value
+
+        low, high = 0, len(positions)
+        while low < high:
+            middle = (low + high) // 2
+            if shown(positions[middle]):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _cached_select(self, where: Union[str, Callable, Search, Predicate], sorted: Optional[Sorted]) -> np.ndarray:
+        sort_key = (sorted.column, sorted.ascending) if sorted is not None else None
+        cache_key = (where, sort_key, self.generation)
+        try:
+            positions = self._query_cache.get(cache_key)
+        except TypeError:
+            # Unhashable filters are evaluated every time
+            return self._select(where, sorted)
+        if positions is None:
+            positions = self._select(where, sorted)
+            self._query_cache[cache_key] = positions
+            if len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last = False)
+        else:
+            self._query_cache.move_to_end(cache_key)
+        return positions
+
+    def _page_order(self, sorted: Optional[Sorted], paged: Optional[Paged]) -> Optional[Sorted]:
+        # A cursor needs a total order; without a sort column the primary key gives one
+        if sorted is None and paged is not None and paged.cursor is not None:
+            return Sorted.By(self.primary_key)
+        return sorted
 
-        if primary_key:
-            self.primary_key = primary_key
+    def _slice_page(self, positions: np.ndarray, sorted: Optional[Sorted], paged: Optional[Paged]) -> np.ndarray:
+        if paged is None or (paged.index is None and paged.cursor is None):
+            return positions
+        if paged.cursor is not None:
+            start = self._cursor_start(positions, sorted, paged.cursor)
         else:
-            self.primary_key = self.df.columns[0] if not self.df.empty else None
+            start = (paged.index - 1) * paged.size
+        return positions[start : start + paged.size]
+
+    def _rows(self, positions: np.ndarray) -> pd.DataFrame:
+        # Only the requested rows are materialized; the full table is never copied
+        return self.df.take(positions)
+
+    def query(self,
+              where: Union[str, Callable, Search, Predicate] = None,
+              sorted: Optional[Sorted] = None,
+              paged: Optional[Paged] = None) -> Tuple[int, Union[List[dict], Iterator[List[dict]]]]:
+        # Returns the total match count together with the requested page of records
+        sorted = self._page_order(sorted, paged)
+        positions = self._cached_select(where, sorted)
+        total = len(positions)
+        if paged is not None and paged.index is None and paged.cursor is None:
+            def chunk_generator():
+                for start in range(0, total, paged.size):
+                    yield self._rows(positions[start : start + paged.size]).to_dict('records')
+            return total, chunk_generator()
+        return total, self._rows(self._slice_page(positions, sorted, paged)).to_dict('records')
+
+    def stream(self,
+               where: Union[str, Callable, Search, Predicate] = None,
+               columns: Optional[List[str]] = None,
+               size: int = None) -> Iterator[List[dict]]:
+        # Yields the matching records, projected onto 'columns', at most 'size' at a time.
+        # An unloaded table with nothing left in its journal is read from the CSV one chunk at a time,
+        # so memory follows the chunk size instead of the file size and the table stays unloaded
+        size = size or self.LOAD_CHUNK_SIZE
+        if self._loaded or not self.file_path.exists() or (self._journal is not None and not self._journal.is_empty()):
+            return self._stream_loaded(where, columns, size)
+        return self._stream_csv(where, columns, size)
+
+    def _project(self, frame: pd.DataFrame, columns: Optional[List[str]]) -> pd.DataFrame:
+        if columns is None:
+            return frame
+        missing = [column for column in columns if column not in frame.columns]
+        if missing:
+            raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
+                                f'Column(s) {', '.join(missing)} do not exist')
+        return frame[columns]
+
+    def _stream_loaded(self, where, columns: Optional[List[str]], size: int) -> Iterator[List[dict]]:
+        positions = self._cached_select(where, None)
+        for start in range(0, len(positions), size):
+            yield self._project(self._rows(positions[start : start + size]), columns).to_dict('records')
+
+    def _stream_csv(self, where, columns: Optional[List[str]], size: int) -> Iterator[List[dict]]:
+        with open(self.file_path, 'rb') as f:
+            try:
+                chunks = pd.read_csv(f, dtype = self._read_dtypes() or None, chunksize = size, **CSV_NA)
+                for chunk in chunks:
+                    chunk = self._narrow(chunk.reset_index(drop = True))
+                    if self.primary_key in chunk.columns and pd.api.types.is_string_dtype(chunk[self.primary_key]):
+                        chunk[self.primary_key] = chunk[self.primary_key].str.strip()
+                    if where is not None:
+                        chunk = chunk.take(self._over(chunk)._select(where, None))
+                    if not chunk.empty:
+                        yield self._project(chunk, columns).to_dict('records')
+            except pd.errors.EmptyDataError:
+                return
+
+    def _over(self, frame: pd.DataFrame) -> 'GenericDatabase':
+        # An unjournaled in-memory table holding one chunk, so every kind of filter runs on it unchanged
+        view = GenericDatabase(self.file_path, primary_key = self.primary_key, journaled = False)
+        view._df = frame
+        view._loaded = True
+        return view
 
     def get_count(self,
-                  where: Union[str, Callable] = None) -> int:
+                  where: Union[str, Callable, Search, Predicate] = None) -> int:
         if where is not None:
-            if isinstance(where, str):
-                try:
-                    return len(self.df.query(where))
-                except Exception as e:
-                    raise DatabaseError(DatabaseErrorKind.INVALID_QUERY, 
-                                        f'Invalid query: \'{where}\'')
-            elif callable(where):
-                return len(self.df[self.df.apply(where, axis = 1)])
+            return len(self._cached_select(where, None))
         else:
-            return len(self.df)
+            return self._row_count()
         
     def get_columns(self) -> List[str]:
+        if not self._loaded and self.file_path.exists():
+            # The header is enough, so the table itself stays unloaded
+            return pd.read_csv(self.file_path, nrows = 0).columns.tolist()
         return self.df.columns.tolist()
     
-    def get_keys(self) -> List[str]:
+    def get_keys(self, positions: np.ndarray = None) -> List[str]:
+        self._ensure_loaded()
+        if positions is not None:
+            return self._keys_at(positions)
         return self.df[self.primary_key].astype(str).tolist() if self.primary_key else []
     
     def has_key(self, key: str) -> bool:
+        self._ensure_loaded()
         if not self.primary_key:
             raise DatabaseError(DatabaseErrorKind.UNDEFINED_PRIMARY_KEY)
-        # return key in self.get_keys()
-        return (self.df[self.primary_key].astype(str).str.strip() == key).any()    
+        return self._find_key(key) is not None
 
     def get_records_as_dataframe(self, 
-                                 where: Union[str, Callable] = None,
+                                 where: Union[str, Callable, Search, Predicate] = None,
                                  sorted: Optional[Sorted] = None,
-                                 page: Optional[Paged] = None) -> pd.DataFrame:
-        temp_df = self.df.copy()
-        if where is not None:
-            if isinstance(where, str):
-                try:
-                    temp_df = temp_df.query(where)
-                except Exception as e:
-                    raise DatabaseError(DatabaseErrorKind.INVALID_QUERY,
-                                        f'Invalid query: \'{where}\'')
-            elif callable(where):
-                temp_df = temp_df[temp_df.apply(where, axis=1)]
-        if sorted is not None:
-            if sorted.column in temp_df.columns:
-                temp_df = temp_df.sort_values(by = sorted.column, ascending = sorted.ascending)
-            else:
-                raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
-                                    f'Column \'{sorted.column}\' does not exist for sorting')
-        if page is not None and page.index is not None:
-            start = (page.index - 1) * page.size
-            end = start + page.size
-            temp_df = temp_df.iloc[start:end]
-        return temp_df
+                                 page: Optional[Paged] = None,
+                                 detached: bool = False) -> pd.DataFrame:
+        # Returns a copy-on-write view unless 'detached' asks for an independent copy
+        if where is None and sorted is None and (page is None or (page.index is None and page.cursor is None)):
+            temp_df = self.df.iloc[:]
+        else:
+            sorted = self._page_order(sorted, page)
+            temp_df = self._rows(self._slice_page(self._cached_select(where, sorted), sorted, page))
+        return temp_df.copy() if detached else temp_df
 
     def get_records(self, 
-                    where: Union[str, Callable] = None, 
+                    where: Union[str, Callable, Search, Predicate] = None, 
                     sorted: Optional[Sorted] = None, 
                     paged: Optional[Paged] = None) -> Union[List[dict], Iterator[List[dict]]]:
-        temp_df = self.df.copy() # Work on a copy to avoid sorting the actual DB
-        if where is not None:
-            if isinstance(where, str):
-                try:
-                    temp_df = temp_df.query(where)
-                except Exception as e:
-                    raise DatabaseError(DatabaseErrorKind.INVALID_QUERY,
-                                        f'Invalid query: \'{where}\'')
-            elif callable(where):
-                temp_df = temp_df[temp_df.apply(where, axis=1)]
-        if sorted is not None:
-            if sorted.column in temp_df.columns:
-                temp_df = temp_df.sort_values(by = sorted.column, ascending = sorted.ascending)
-            else:
-                raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
-                                    f'Column \'{sorted.column}\' does not exist for sorting')
-        if paged is not None:
-            if paged.index is not None:
-                start = (paged.index - 1) * paged.size
-                end = start + paged.size
-                return temp_df.iloc[start:end].to_dict('records')
-            else:
-                def chunk_generator():
-                    total = len(temp_df)
-                    for start in range(0, total, paged.size):
-                        yield temp_df.iloc[start : start + paged.size].to_dict('records')
-                return chunk_generator()
-        return temp_df.to_dict('records')
+        if sorted is None and paged is not None and paged.index is None and paged.cursor is None:
+            # Without a total to report, an unsorted stream doesn't need the table in memory
+            return self.stream(where, size = paged.size)
+        return self.query(where = where, sorted = sorted, paged = paged)[1]
     
+    def get_records_at(self, positions: np.ndarray) -> List[dict]:
+        return self._rows(positions).to_dict('records')
+
     def get_record(self, *, index : int = None, key : str = None) -> dict:
         if index is not None and key is not None:
             raise ArgumentError('Provide either \'index\' or \'key\', not both')
@@ -149,46 +739,164 @@ class GenericDatabase:
                 raise ArgumentError('Record index out of range')
             return self.df.iloc[index].to_dict()
         elif key is not None:
-            if not self.primary_key:
-                raise DatabaseError(DatabaseErrorKind.UNDEFINED_PRIMARY_KEY)
-            filtered_df = self.df[self.df[self.primary_key].astype(str) == key]
-            if filtered_df.empty:
-                raise DatabaseError(DatabaseErrorKind.NO_KEY, 
-                                    f'An entry with key \'{key}\' does not exist')
-            return filtered_df.iloc[0].to_dict()
+            return self.df.iloc[self._locate(key)].to_dict()
         else:
             raise ArgumentError('Index must be an integer or string')
         
     def validate_add_record(self, record : dict):
+        self._ensure_loaded()
         pk_val = record.get(self.primary_key)
-        if pk_val and str(pk_val) in self.df[self.primary_key].astype(str).values:
+        if pk_val and self._normalize_key(pk_val) in self._key_index:
             raise DatabaseError(DatabaseErrorKind.DUPLICATE_KEY,
                                 f'The key \'{pk_val}\' already exists')
 
     def add_record(self, record: dict):
-        if self.df.empty:
-            self.df = pd.DataFrame([record])
-            if not self.primary_key: self.primary_key = list(record.keys())[0]
-            self.modified = True
-            return
+        self._check_writable()
+        if not self.primary_key and self._row_count() == 0:
+            self.primary_key = list(record.keys())[0]
         if self.primary_key:
             self.validate_add_record(record)
-        self.df = pd.concat([self.df, pd.DataFrame([record])], ignore_index=True)
-        self.modified = True
+        position = self._row_count()
+        self._pending.append(dict(record))
+        if self.primary_key in record:
+            self._key_index.setdefault(self._normalize_key(record[self.primary_key]), position)
+            self._inserted.add(self._normalize_key(record[self.primary_key]))
+            if self._batch is not None:
+                self._batch.added_keys[self._normalize_key(record[self.primary_key])] = None
+        self._index_insert(record, position)
+        if len(self._pending) >= self.APPEND_BUFFER_SIZE:
+            self._flush_pending()
+        self._log({'op' : 'insert', 'record' : record})
+        self._mark_modified()
+
+    def _string_mask(self, where: str) -> np.ndarray:
+        # Equality, membership and range strings run as predicates on the indexes,
+        # anything else is left to pandas
+        predicate = compile_where(where)
+        if predicate is not None:
+            try:
+                return predicate.mask(self)
+            except DatabaseError:
+                pass
+        try:
+            return np.asarray(self.df.eval(where), dtype = bool)
+        except Exception as e:
+            raise DatabaseError(DatabaseErrorKind.INVALID_QUERY,
+                                f'Invalid query: \'{where}\'')
+
+    def _where_mask(self, where: Union[str, Callable, Predicate]) -> Optional[np.ndarray]:
+        if isinstance(where, Predicate):
+            return where.mask(self)
+        elif isinstance(where, str):
+            return self._string_mask(where)
+        elif callable(where):
+            return self.df.apply(where, axis = 1).to_numpy(dtype = bool)
+        return None
+
+    def _keys_at(self, positions) -> List[str]:
+        if not self.primary_key:
+            return []
+        return [self._normalize_key(key) for key in self.df[self.primary_key].take(positions).tolist()]
     
-    def update_records(self, where: Union[str, Callable], updates: dict):
+    def update_records(self, where: Union[str, Callable, Predicate], updates: dict) -> int:
         # Update multiple rows based on a condition.
-        if self.df.empty: return
-        if isinstance(where, str):
-            mask = self.df.eval(where)
-        elif callable(where):
-            mask = self.df.apply(where, axis=1)
-        else:
+        self._check_writable()
+        if self.df.empty: return 0
+        mask = self._where_mask(where)
+        if mask is None: return 0
+        return self.update_at(np.flatnonzero(mask), updates)
+
+    def _column_index(self, column: str) -> dict:
+        if column not in self._column_indexes:
+            groups = self.df.groupby(column, observed = True, sort = False).indices if not self.df.empty else {}
+            self._column_indexes[column] = {value : positions.tolist() for value, positions in groups.items()}
+        return self._column_indexes[column]
+
+    def _index_insert(self, record: dict, position: int):
+        for column, index in self._column_indexes.items():
+            if column in record:
+                index.setdefault(record[column], []).append(position)
+
+    def _index_move(self, column: str, positions, old_values, new_value):
+        # Moves rows from the entries of their old values to the entry of the new one
+        index = self._column_indexes.get(column)
+        if index is None:
             return
-        for key, value in updates.items():
-            if key in self.df.columns:
-                self.df.loc[mask, key] = value
-        self.modified = True
+        moved = set(positions)
+        for value in set(old_values):
+            remaining = [position for position in index.get(value, []) if position not in moved]
+            if remaining:
+                index[value] = remaining
+            else:
+                index.pop(value, None)
+        index.setdefault(new_value, []).extend(positions)
+
+    def lookup(self, column: str, value) -> np.ndarray:
+        # Positions of the rows whose column equals the value
+        if self.df.empty or column not in self.df.columns:
+            return np.empty(0, dtype = np.intp)
+        if column in self._indexed:
+            return np.sort(np.asarray(self._column_index(column).get(value, []), dtype = np.intp))
+        return np.flatnonzero((self.df[column] == value).fillna(False).to_numpy(dtype = bool))
+
+    def lookup_in(self, column: str, values) -> np.ndarray:
+        # Positions of the rows whose column is any of the values
+        if self.df.empty or column not in self.df.columns:
+            return np.empty(0, dtype = np.intp)
+        if column in self._indexed:
+            index = self._column_index(column)
+            return np.sort(np.asarray([position for value in set(values) for position in index.get(value, [])], dtype = np.intp))
+        return np.flatnonzero(np.asarray(self.df[column].isin(list(values)), dtype = bool))
+
+    def count(self, column: str, value) -> int:
+        if column in self._indexed and column in self.df.columns:
+            return len(self._column_index(column).get(value, []))
+        return len(self.lookup(column, value))
+
+    def replace_values(self, column: str, old, new) -> int:
+        # Rewrites a value wherever it occurs in a column with one column update, as a foreign key cascade does
+        return self.update_at(self.lookup(column, old), {column : new})
+
+    def duplicate_key_positions(self) -> np.ndarray:
+        # Rows whose primary key already appears in an earlier row
+        # The key index holds one entry per distinct key, so equal sizes mean there is nothing to find
+        if not self.primary_key or self.df.empty or len(self._key_index) == len(self.df):
+            return np.empty(0, dtype = np.intp)
+        return np.flatnonzero(self.df[self.primary_key].duplicated(keep = 'first').to_numpy())
+
+    def drop_duplicate_keys(self) -> int:
+        # Keeps the first row of each key, the one key lookups already resolve to
+        self._check_writable()
+        positions = self.duplicate_key_positions()
+        if len(positions) == 0:
+            return 0
+        keys = self._keys_at(positions)
+        self._delete_positions(positions)
+        # The keys remain in the table, so the CSV is rewritten rather than appended to
+        self._updated.update(key for key in keys if key not in self._inserted)
+        # A delete by key would remove the first row on replay, so this is journaled as its own step
+        self._log({'op' : 'dedupe'})
+        self._mark_modified()
+        return len(positions)
+
+    def update_at(self, positions: np.ndarray, updates: dict) -> int:
+        self._check_writable()
+        if len(positions) == 0:
+            return 0
+        keys = self._keys_at(positions)
+        for column, value in updates.items():
+            if column in self.df.columns:
+                self._admit_values(column, [value])
+                if column in self._column_indexes:
+                    self._index_move(column, list(positions), self.df[column].take(positions).tolist(), value)
+                self.df.iloc[positions, self.df.columns.get_loc(column)] = value
+        if self.primary_key in updates:
+            self._key_index_stale = True
+        for key in keys:
+            self._track_update(key, self._normalize_key(updates.get(self.primary_key, key)))
+        self._log({'op' : 'update', 'keys' : keys, 'updates' : updates})
+        self._mark_modified()
+        return len(positions)
 
     def validate_update_record(self, updates: dict, *, index : int = None, key : str = None):
         if index is not None and key is not None:
@@ -197,40 +905,87 @@ class GenericDatabase:
             if index < 0 or index >= len(self.df):
                 raise ArgumentError('Record index out of range')
         elif key is not None:
-            if not self.primary_key:
-                raise DatabaseError(DatabaseErrorKind.UNDEFINED_PRIMARY_KEY)
-            filtered_df = self.df[self.df[self.primary_key].astype(str) == key]
-            if filtered_df.empty:
-                raise DatabaseError(DatabaseErrorKind.NO_KEY, 
-                                    f'An entry with key \'{key}\' does not exist')
-            index = filtered_df.index[0]
+            index = self._locate(key)
         if self.primary_key and self.primary_key in updates:
-            new_pk = str(updates[self.primary_key])
-            current_pk = str(self.df.at[index, self.primary_key])            
+            new_pk = self._normalize_key(updates[self.primary_key])
+            current_pk = self._normalize_key(self.df.at[index, self.primary_key])
             if new_pk != current_pk:
-                if new_pk in self.df[self.primary_key].astype(str).values:
+                if new_pk in self._key_index:
                     raise DatabaseError(DatabaseErrorKind.DUPLICATE_KEY)
         return index
 
     def update_record(self, updates: dict, *, index : int = None, key : str = None):
+        self._check_writable()
         index = self.validate_update_record(updates, index = index, key = key)
-        idx = index if index is not None else key
+        old_pk = self._normalize_key(self.df.at[index, self.primary_key]) if self.primary_key else None
         for updated_key, updated_value in updates.items():
             if updated_key in self.df.columns:
-                self.df.at[idx, updated_key] = updated_value
-        self.modified = True
+                self._admit_values(updated_key, [updated_value])
+                if updated_key in self._column_indexes:
+                    self._index_move(updated_key, [index], [self.df.at[index, updated_key]], updated_value)
+                self.df.at[index, updated_key] = updated_value
+        if self.primary_key in updates:
+            new_pk = self._normalize_key(updates[self.primary_key])
+            if new_pk != old_pk:
+                if self._key_index.get(old_pk) == index:
+                    del self._key_index[old_pk]
+                self._key_index[new_pk] = index
+        if old_pk is not None:
+            self._track_update(old_pk, self._normalize_key(updates.get(self.primary_key, old_pk)))
+        self._log({'op' : 'update', 'keys' : [old_pk], 'updates' : updates})
+        self._mark_modified()
+
+    def _track_update(self, old_key: str, new_key: str):
+        if self._batch is not None and old_key != new_key and old_key in self._batch.added_keys:
+            # A row added in the batch and then renamed is validated under its new key
+            del self._batch.added_keys[old_key]
+            self._batch.added_keys[new_key] = None
+        if old_key in self._inserted:
+            self._inserted.discard(old_key)
+            self._inserted.add(new_key)
+        else:
+            self._updated.add(old_key)
+
+    def _track_deletes(self, keys: List[str]):
+        for key in keys:
+            if key in self._inserted:
+                self._inserted.discard(key)
+            else:
+                self._updated.discard(key)
+                self._deleted.add(key)
+
+    def _reset_tracking(self):
+        self._inserted = set()
+        self._updated = set()
+        self._deleted = set()
+
+    def _delete_positions(self, positions):
+        keep = np.ones(len(self.df), dtype = bool)
+        keep[positions] = False
+        self.df = self.df[keep].reset_index(drop = True)
+        # Rows after the removed ones shift up, so the key index is rebuilt and the column indexes dropped
+        self._key_index_stale = True
+        self._column_indexes.clear()
 
-    def delete_records(self, where: Union[str, Callable]):
+    def delete_records(self, where: Union[str, Callable, Predicate]):
         # Delete multiple rows based on a condition
+        self._check_writable()
         if self.df.empty: return
-        if isinstance(where, str):
-            mask = self.df.eval(where)
-            self.df = self.df[~mask]
-        elif callable(where):
-            mask = self.df.apply(where, axis = 1)
-            self.df = self.df[~mask]
-        self.df.reset_index(drop = True, inplace = True)
-        self.modified = True
+        mask = self._where_mask(where)
+        if mask is None: return
+        self.delete_at(np.flatnonzero(mask))
+
+    def delete_at(self, positions: np.ndarray) -> int:
+        # Removes all the given rows with a single rebuild of the table
+        self._check_writable()
+        if len(positions) == 0:
+            return 0
+        keys = self._keys_at(positions)
+        self._delete_positions(positions)
+        self._track_deletes(keys)
+        self._log({'op' : 'delete', 'keys' : keys})
+        self._mark_modified()
+        return len(positions)
 
     def delete_record(self, *, index: int = None, key: str = None):
         # Delete a single row by its specific index or a key value
@@ -239,22 +994,342 @@ class GenericDatabase:
         if index is not None:
             if index < 0 or index >= len(self.df):
                 raise ArgumentError('Record index out of range')
-            self.df = self.df.drop(index).reset_index(drop = True)
         elif key is not None:
-            if not self.primary_key:
-                raise DatabaseError(DatabaseErrorKind.UNDEFINED_PRIMARY_KEY)
-            filtered_df = self.df[self.df[self.primary_key].astype(str) == key]
-            if filtered_df.empty:
-                raise DatabaseError(DatabaseErrorKind.NO_KEY, 
-                                    f'An entry with key \'{key}\' does not exist')
-            self.df = self.df[self.df[self.primary_key].astype(str) != key].reset_index(drop = True)
-        self.modified = True
+            index = self._locate(key)
+        else:
+            return
+        self.delete_at([index])
+
+    def _log(self, entry: dict):
+        if self._journal is None or self._replaying or not self.primary_key:
+            return
+        if self._batch is not None:
+            self._batch.log.append(entry)
+            return
+        self._journal.append(entry)
+        if self._journal.entry_count >= self.JOURNAL_COMPACT_THRESHOLD:
+            self.compact()
+
+    @property
+    def in_batch(self) -> bool:
+        return self._batch is not None
+
+    def batch(self, validate: Callable[[pd.DataFrame], FrameValidation] = None):
+        # Groups writes: rows added in the block are validated together and the journal written once
+        # when it ends, and every write is undone if it raises
+        return _batched((self, validate))
+
+    def _begin_batch(self, validate: Optional[Callable]) -> bool:
+        self._ensure_loaded()
+        if self._batch is not None:
+            return False # nested batches join the outer one
+        if self._pending:
+            self._flush_pending()
+        tracking = (set(self._inserted), set(self._updated), set(self._deleted))
+        self._batch = _BatchState(self._df.copy(deep = False), tracking, self.modified, validate) # Copy-on-write snapshot
+        return True
+
+    def _check_batch(self):
+        batch = self._batch
+        if batch.validate is None or not batch.added_keys:
+            return
+        positions = [self._key_index[key] for key in batch.added_keys if key in self._key_index]
+        if not positions:
+            return # every added row was deleted again
+        validation = batch.validate(self._rows(positions).reset_index(drop = True))
+        if not validation.is_valid():
+            raise validation.error_of(int(np.argmin(validation.valid.to_numpy())))
+
+    def _commit_batch(self):
+        batch, self._batch = self._batch, None
+        if batch.log:
+            self._journal.append_many(batch.log)
+            if self._journal.entry_count >= self.JOURNAL_COMPACT_THRESHOLD:
+                batch.compact_requested = True
+        if batch.compact_requested:
+            self.compact()
+
+    def _rollback_batch(self):
+        batch, self._batch = self._batch, None
+        self._df = batch.frame
+        self._pending = []
+        self._inserted, self._updated, self._deleted = batch.tracking
+        self.modified = batch.modified
+        self._key_index_stale = True
+        self._column_indexes.clear()
+        self.generation += 1
+        self._invalidate_caches()
+
+    def _replay_journal(self):
+        replayed = False
+        self._replaying = True
+        try:
+            for entry in self._journal.read():
+                try:
+                    self._apply_journal_entry(entry)
+                except (DatabaseError, ArgumentError, KeyError):
+                    # Entries that no longer apply (e.g. already compacted) are skipped
+                    pass
+                replayed = True
+        finally:
+            self._replaying = False
+        if replayed:
+            self.modified = True
+
+    def _apply_journal_entry(self, entry: dict):
+        match entry['op']:
+            case 'insert':
+                record = entry['record']
+                key = record.get(self.primary_key)
+                if key is not None and self.has_key(key):
+                    self.update_record(record, key = key)
+                else:
+                    self.add_record(record)
+            case 'update':
+                positions = [self._key_index[key] for key in entry['keys'] if key in self._key_index]
+                if self.primary_key in entry['updates']:
+                    # Key changes still go through the duplicate check of update_record
+                    for position in positions:
+                        self.update_record(entry['updates'], index = position)
+                elif positions:
+                    # A set-based update (e.g. a cascade) is replayed as one write
+                    self.update_at(np.array(positions), entry['updates'])
+            case 'import':
+                # Appended keys may already be in the CSV if the import was compacted, so they are upserted
+                mode = ImportMode[entry['mode']]
+                frame = pd.DataFrame(entry['rows'], columns = entry['columns'], dtype = str)
+                self._merge_import(frame, ImportMode.Upsert if mode == ImportMode.Append else mode)
+            case 'dedupe':
+                self.drop_duplicate_keys()
+            case 'delete':
+                positions = [self._key_index[key] for key in entry['keys'] if key in self._key_index]
+                if positions:
+                    keys = self._keys_at(positions)
+                    self._delete_positions(positions)
+                    self._track_deletes(keys)
+                    self._mark_modified()
+
+    def import_csv(self, path: Path, mode: ImportMode = ImportMode.Append, validate: Callable[[pd.DataFrame], FrameValidation] = None) -> ImportReport:
+        self._check_writable()
+        self._ensure_loaded()
+        if not self.primary_key:
+            raise DatabaseError(DatabaseErrorKind.UNDEFINED_PRIMARY_KEY)
+        start = time.perf_counter()
+        columns = self.get_columns()
+        header = pd.read_csv(path, nrows = 0).columns.tolist()
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
+                                f'The file is missing the column(s) {', '.join(missing)}')
+        columns = columns or header
+
+        report = ImportReport(mode)
+        accepted, rejected = [], []
+        seen = set() # keys accepted from earlier chunks
+        # Read as text so every chunk is validated the way a typed-in entry would be
+        for chunk in pd.read_csv(path, dtype = str, keep_default_na = False, chunksize = self.IMPORT_CHUNK_SIZE):
+            chunk = chunk[columns]
+            chunk[self.primary_key] = chunk[self.primary_key].str.strip()
+            report.rows_read += len(chunk)
+            reasons = pd.Series(None, index = chunk.index, dtype = object)
+            if validate is not None:
+                validation = validate(chunk)
+                # Filled back to front so each row keeps the message of its first failing field
+                for column in reversed(validation.errors.columns):
+                    reasons = validation.messages[column].where(validation.errors[column], reasons)
+
+            keys = chunk[self.primary_key]
+            valid = reasons.isna()
+            duplicated = keys[valid].duplicated() | keys[valid].isin(seen)
+            reasons[duplicated[duplicated].index] = 'The key appears earlier in the file'
+            if mode == ImportMode.Append:
+                exists = reasons.isna() & keys.isin(self._key_index.keys())
+                reasons[exists] = 'The key already exists'
+
+            valid = reasons.isna()
+            seen.update(keys[valid])
+            accepted.append(chunk[valid])
+            if not valid.all():
+                # Line 1 is the header
+                rejected.append(chunk[~valid].assign(line = chunk.index[~valid] + 2, reason = reasons[~valid]))
+
+        frame = pd.concat(accepted, ignore_index = True) if accepted else pd.DataFrame(columns = columns)
+        report.rejected = pd.concat(rejected, ignore_index = True) if rejected else pd.DataFrame(columns = columns + ['line', 'reason'])
+        report.inserted, report.updated = self._merge_import(frame, mode)
+        if not frame.empty or mode == ImportMode.Replace:
+            self._log({'op' : 'import', 'mode' : mode.name, 'columns' : columns, 'rows' : frame.values.tolist()})
+            # A whole import in the journal is folded into the CSV right away rather than left to grow it
+            self.compact()
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _merge_import(self, frame: pd.DataFrame, mode: ImportMode) -> Tuple[int, int]:
+        # Applies an already validated import in one step, returning the (inserted, updated) row counts
+        self._column_indexes.clear()
+        keys = frame[self.primary_key].map(self._normalize_key)
+        if mode == ImportMode.Replace:
+            self._track_deletes(self.get_keys())
+            # Starting from an empty frame casts the rows to the schema dtypes
+            self._df = pd.DataFrame()
+            self._pending = []
+            self._append_frame(frame.copy())
+            self._inserted.update(keys)
+            self._key_index_stale = True
+            self._mark_modified()
+            return len(frame), 0
+
+        existing = keys.isin(self._key_index.keys())
+        updated = frame[existing]
+        if not updated.empty:
+            positions = keys[existing].map(self._key_index).to_numpy()
+            df = self.df
+            updated = self._conform(updated.copy(), {column : df[column].dtype for column in updated.columns if column in df.columns})
+            for column in updated.columns:
+                df.iloc[positions, df.columns.get_loc(column)] = updated[column].to_numpy()
+            self._updated.update(key for key in keys[existing] if key not in self._inserted)
+
+        inserted = frame[~existing]
+        if not inserted.empty:
+            if self._pending:
+                self._flush_pending()
+            start = len(self._df)
+            self._append_frame(inserted.copy())
+            self._key_index.update(zip(keys[~existing], range(start, start + len(inserted))))
+            self._inserted.update(keys[~existing])
 
-    def save(self):
-        if self.modified:
-            self.df.to_csv(self.file_path, index=False)
+        if not frame.empty:
+            self._mark_modified()
+        return len(inserted), len(updated)
+
+    def _write_csv(self, df: pd.DataFrame) -> int:
+        # Written to a temporary file first so an interrupted write never leaves a truncated CSV
+        temp_path = self.file_path.with_name(self.file_path.name + '.tmp')
+        df.to_csv(temp_path, index = False)
+        os.replace(temp_path, self.file_path)
+        return self.file_path.stat().st_size
+
+    def _appended_rows(self) -> Optional[pd.DataFrame]:
+        # Rows that can simply be appended to the CSV, if only inserts happened since it was written
+        if self._rewrite_required or self._updated or self._deleted or not self._inserted or not self.file_path.exists():
+            return None
+        start = len(self.df) - len(self._inserted)
+        if start < 0 or set(self._keys_at(np.arange(start, len(self.df)))) != self._inserted:
+            return None
+        return self.df.iloc[start:]
+
+    def _append_csv(self, rows: pd.DataFrame) -> int:
+        # Copies the existing bytes as-is and only serializes the new rows, then swaps the file in
+        temp_path = self.file_path.with_name(self.file_path.name + '.tmp')
+        shutil.copyfile(self.file_path, temp_path)
+        data = rows.to_csv(header = False, index = False).encode('utf-8')
+        with open(temp_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    data = os.linesep.encode('utf-8') + data
+            f.write(data)
+            written = f.tell() # the copied file plus the new rows
+        os.replace(temp_path, self.file_path)
+        return written
+
+    def compact(self):
+        # Folds the journal into a fresh CSV on a background thread
+        if self._journal is None or (self._compaction is not None and self._compaction.is_alive()):
+            return
+        if self._batch is not None:
+            self._batch.compact_requested = True
+            return
+        self._finish_compaction()
+        snapshot = self.df.copy(deep = False) # Copy-on-write: later edits don't touch the snapshot
+        generation = self.generation
+        if not self._journal.seal():
+            return
+        self._reset_tracking()
+        self._compaction_result = None
+
+        def write_snapshot():
+            # Only the outcome is recorded here; the table itself is updated by whoever joins the thread
+            try:
+                self._write_csv(snapshot)
+                self._write_cache(snapshot)
+                self._journal.discard_sealed()
+            except Exception as e:
+                self._compaction_result = (e, generation)
+            else:
+                self._compaction_result = (None, generation)
+
+        self._compaction = threading.Thread(target = write_snapshot, daemon = True)
+        self._compaction.start()
+
+    def _finish_compaction(self):
+        # Waits for the background write and applies its outcome on the calling thread
+        if self._compaction is None:
+            return
+        self._compaction.join()
+        self._compaction = None
+        error, generation = self._compaction_result
+        if error is not None:
+            # The tracked changes no longer describe what the CSV is missing, so the next save rewrites it
+            self._rewrite_required = True
+            self.modified = True
+            return
+        self._rewrite_required = False
+        if self.generation == generation:
             self.modified = False
 
+    def save(self) -> SaveStats:
+        self._finish_compaction()
+        if not self.modified:
+            self.last_save_stats = SaveStats('skipped')
+            return self.last_save_stats
+        start = time.perf_counter()
+        if self._journal is not None:
+            self._journal.seal()
+        appended = self._appended_rows()
+        if appended is not None:
+            stats = SaveStats('append', len(appended), self._append_csv(appended))
+        else:
+            stats = SaveStats('rewrite', len(self.df), self._write_csv(self.df))
+            # The cache is only written from a frame the CSV was just rewritten from
+            self._write_cache(self.df)
+            self._rewrite_required = False
+        if self._journal is not None:
+            self._journal.discard_sealed()
+        self._reset_tracking()
+        self.modified = False
+        stats.seconds = time.perf_counter() - start
+        self.last_save_stats = stats
+        return stats
+
+# Tables in the outermost batch open on each thread
+_open_batch = threading.local()
+
+@contextmanager
+def _batched(*batches: Tuple[GenericDatabase, Optional[Callable]]):
+    outer = getattr(_open_batch, 'tables', None)
+    if outer is not None:
+        # A nested batch joins the outermost one: tables it starts commit or roll back with all the others
+        outer.extend(database for database, validate in batches if database._begin_batch(validate))
+        yield
+        return
+    begun = _open_batch.tables = []
+    try:
+        begun.extend(database for database, validate in batches if database._begin_batch(validate))
+        yield
+        # Every table is validated before any commits, so a failure leaves all of them as they were
+        for database in begun:
+            database._check_batch()
+        for database in begun:
+            database._commit_batch()
+    except BaseException:
+        for database in begun:
+            if database.in_batch:
+                database._rollback_batch()
+        raise
+    finally:
+        _open_batch.tables = None
+
 def _get_data_dir() -> Path:
     if getattr(sys, 'frozen', False):
         return Path(sys.executable).parent / 'data'
@@ -264,7 +1339,7 @@ def _get_data_dir() -> Path:
 # Handles and stores student records
 class StudentDirectory:
     _path = _get_data_dir() / 'students.csv'
-    _db   = GenericDatabase(_path, primary_key = 'id')
+    _db   = GenericDatabase(_path, primary_key = 'id', schema = StudentEntry.get_fields(), indexed = ['program_code'])
 
     @staticmethod
     def get_entry_kind():
@@ -278,6 +1353,14 @@ class StudentDirectory:
     def get_primary_key(self):
         return self._db.primary_key
     
+    @classmethod
+    def preload(self, progress: Callable[[float], None] = None):
+        self._db.load(progress)
+
+    @classmethod
+    def is_loaded(self) -> bool:
+        return self._db.is_loaded
+
     @classmethod
     def get_columns(self) -> List[str]:
         return self._db.get_columns()
@@ -290,17 +1373,25 @@ class StudentDirectory:
 
     @classmethod
     def has_id(self, key: str) -> bool:
-        return self._db.has_key(str)
+        return self._db.has_key(key)
     
     has_key = has_id
 
     @classmethod
-    def get_count(self, where: Union[str, Callable] = None) -> int:
+    def get_count(self, where: Union[str, Callable, Search, Predicate] = None) -> int:
         return self._db.get_count(where)
 
     @classmethod
-    def get_records(self, where: Union[str, Callable] = None, sorted: Sorted = None, paged: Paged = None) -> List[dict]:
+    def query(self, where: Union[str, Callable, Search, Predicate] = None, sorted: Sorted = None, paged: Paged = None) -> Tuple[int, List[dict]]:
+        return self._db.query(where = where, sorted = sorted, paged = paged)
+
+    @classmethod
+    def get_records(self, where: Union[str, Callable, Search, Predicate] = None, sorted: Sorted = None, paged: Paged = None) -> List[dict]:
         return self._db.get_records(where = where, sorted = sorted, paged = paged)
+
+    @classmethod
+    def stream(self, where: Union[str, Callable, Search, Predicate] = None, columns: List[str] = None, size: int = None) -> Iterator[List[dict]]:
+        return self._db.stream(where = where, columns = columns, size = size)
     
     @classmethod 
     def get_record(self, *, index : int = None, key : str = None) -> dict:
@@ -308,11 +1399,13 @@ class StudentDirectory:
     
     @classmethod 
     def add_record(self, record : dict[str, str]):
-        StudentEntry.validate_entry(record, requires_all = True, program_directory = ProgramDirectory)
+        # Inside a batch, added records are validated together when it commits
+        if not self._db.in_batch:
+            StudentEntry.validate_entry(record, requires_all = True, program_directory = ProgramDirectory)
         self._db.add_record(record)
 
     @classmethod
-    def update_records(self, where: Union[str, Callable], updates: dict[str, str]):
+    def update_records(self, where: Union[str, Callable, Predicate], updates: dict[str, str]):
         StudentEntry.validate_entry(updates, requires_all = False, program_directory = ProgramDirectory)
         self._db.update_records(where, updates)
 
@@ -322,7 +1415,7 @@ class StudentDirectory:
         self._db.update_record(updates, index = index, key = key)
 
     @classmethod 
-    def delete_records(self, where: Union[str, Callable]):
+    def delete_records(self, where: Union[str, Callable, Predicate]):
         self._db.delete_records(where)
 
     @classmethod
@@ -330,13 +1423,25 @@ class StudentDirectory:
         self._db.delete_record(index = index, key = key)
 
     @classmethod
-    def save(self):
-        self._db.save()
+    def import_csv(self, path: Path, mode: ImportMode = ImportMode.Append) -> ImportReport:
+        return self._db.import_csv(path, mode, validate = self.validate_frame)
+
+    @classmethod
+    def validate_frame(self, frame: pd.DataFrame) -> FrameValidation:
+        return StudentEntry.validate_frame(frame, requires_all = True, program_directory = ProgramDirectory)
+
+    @classmethod
+    def batch(self):
+        return self._db.batch(validate = self.validate_frame)
+
+    @classmethod
+    def save(self) -> SaveStats:
+        return self._db.save()
 
 # Handles and stores program records
 class ProgramDirectory:
     _path = _get_data_dir() / 'programs.csv'
-    _db   = GenericDatabase(_path, primary_key = 'program_code')
+    _db   = GenericDatabase(_path, primary_key = 'program_code', schema = ProgramEntry.get_fields(), indexed = ['college_code'])
 
     @staticmethod
     def get_entry_kind():
@@ -350,6 +1455,14 @@ class ProgramDirectory:
     def get_primary_key(self):
         return self._db.primary_key
     
+    @classmethod
+    def preload(self, progress: Callable[[float], None] = None):
+        self._db.load(progress)
+
+    @classmethod
+    def is_loaded(self) -> bool:
+        return self._db.is_loaded
+
     @classmethod
     def get_columns(self) -> List[str]:
         return self._db.get_columns()
@@ -368,12 +1481,29 @@ class ProgramDirectory:
     has_key = has_program
 
     @classmethod
-    def get_count(self, where: Union[str, Callable] = None) -> int:
+    def count_children(self, key: str) -> int:
+        # Students enrolled in the program
+        return StudentDirectory._db.count('program_code', key)
+
+    @classmethod
+    def children(self, key: str) -> List[dict]:
+        return StudentDirectory._db.get_records_at(StudentDirectory._db.lookup('program_code', key))
+
+    @classmethod
+    def get_count(self, where: Union[str, Callable, Search, Predicate] = None) -> int:
         return self._db.get_count(where)
 
     @classmethod
-    def get_records(self, where : Union[str, Callable] = None, sorted : Sorted = None, paged : Paged = None) -> List[dict]:
+    def query(self, where: Union[str, Callable, Search, Predicate] = None, sorted: Sorted = None, paged: Paged = None) -> Tuple[int, List[dict]]:
+        return self._db.query(where = where, sorted = sorted, paged = paged)
+
+    @classmethod
+    def get_records(self, where : Union[str, Callable, Search, Predicate] = None, sorted : Sorted = None, paged : Paged = None) -> List[dict]:
         return self._db.get_records(where = where, sorted = sorted, paged = paged)
+
+    @classmethod
+    def stream(self, where: Union[str, Callable, Search, Predicate] = None, columns: List[str] = None, size: int = None) -> Iterator[List[dict]]:
+        return self._db.stream(where = where, columns = columns, size = size)
     
     @classmethod 
     def get_record(self, *, index : int = None, key : str = None) -> dict:
@@ -381,11 +1511,13 @@ class ProgramDirectory:
     
     @classmethod 
     def add_record(self, record : dict[str, str]):
-        ProgramEntry.validate_entry(record, requires_all = True, college_directory = CollegeDirectory)
+        # Inside a batch, added records are validated together when it commits
+        if not self._db.in_batch:
+            ProgramEntry.validate_entry(record, requires_all = True, college_directory = CollegeDirectory)
         self._db.add_record(record)
 
     @classmethod
-    def update_records(self, where: Union[str, Callable], updates: dict[str, str]):
+    def update_records(self, where: Union[str, Callable, Predicate], updates: dict[str, str]):
         ProgramEntry.validate_entry(updates, requires_all = False, college_directory = CollegeDirectory)
         self._db.update_records(where, updates)
         # TODO: update student records
@@ -395,57 +1527,93 @@ class ProgramDirectory:
         ProgramEntry.validate_entry(updates, requires_all = False, college_directory = CollegeDirectory)
         count = 1
         old_program_code = self.get_record(index = index, key = key)['program_code']
-        new_program_code = old_program_code
-        if 'program_code' in updates:
-            new_program_code = updates['program_code']
-        self._db.update_record(updates, index = index, key = key)
-        if new_program_code != old_program_code:
-            for student_record in StudentDirectory.get_records(where = f'program_code == \'{old_program_code}\''):
+        new_program_code = updates.get('program_code', old_program_code)
+        renamed = new_program_code != old_program_code
+        # Checked before anything is written so a restricted rename leaves both tables untouched
+        if renamed and action == ConstraintAction.Restrict:
+            referencing = len(StudentDirectory._db.lookup('program_code', old_program_code))
+            if referencing > 0:
+                raise DatabaseError(DatabaseErrorKind.CHANGE_KEY,
+                                    f'The program code \'{old_program_code}\' is still used by {referencing} student entries')
+        # The record and its children change together or not at all
+        with transaction():
+            self._db.update_record(updates, index = index, key = key)
+            if renamed:
                 match action:
                     # renames all student record's program_code to its new name
                     case ConstraintAction.Cascade:
-                        StudentDirectory.update_record({'program_code' : new_program_code}, key = student_record['id'])
+                        count += StudentDirectory._db.replace_values('program_code', old_program_code, new_program_code)
 
                     case ConstraintAction.SetNull:
-                        StudentDirectory.update_record({'program_code' : ''}, key = student_record['id'])
-
-                    case ConstraintAction.Restrict:
-                        raise ValueError('...')
-                count = count + 1
+                        count += StudentDirectory._db.replace_values('program_code', old_program_code, '')
         return count
 
     @classmethod
-    def delete_records(self, where: Union[str, Callable]):
+    def delete_records(self, where: Union[str, Callable, Predicate]):
         self._db.delete_records(where)
         # TODO handle student records
 
     @classmethod
-    def delete_record(self, *, index: int = None, key: str = None, action : ConstraintAction = ConstraintAction.Restrict):
-        count = 1
+    def delete_record(self, *, index: int = None, key: str = None, action : ConstraintAction = ConstraintAction.Restrict) -> dict[EntryKind, int]:
+        # Returns the number of rows deleted (or set to null) in each table
+        counts = {EntryKind.PROGRAM : 1, EntryKind.STUDENT : 0}
         program_code = self.get_record(index = index, key = key)['program_code']
-        for student_record in StudentDirectory.get_records(where = f'program_code == \'{program_code}\''):
+        students = StudentDirectory._db.lookup('program_code', program_code)
+        with transaction():
             match action:
                 # deletes all records referring to the same program_code
                 case ConstraintAction.Cascade:
-                    StudentDirectory.delete_record(key = student_record['id'])
+                    counts[EntryKind.STUDENT] = StudentDirectory._db.delete_at(students)
 
                 case ConstraintAction.SetNull:
-                    StudentDirectory.update_record({'program_code' : ''}, key = student_record['id'])
+                    counts[EntryKind.STUDENT] = StudentDirectory._db.update_at(students, {'program_code' : ''})
 
                 case ConstraintAction.Restrict:
-                    raise ValueError('...')
-            count = count + 1
-        self._db.delete_record(index = index, key = key)
-        return count
+                    if len(students) > 0:
+                        raise DatabaseError(DatabaseErrorKind.REFERENCED_KEY,
+                                            f'The program code \'{program_code}\' is still used by {len(students)} student entries')
+            self._db.delete_record(index = index, key = key)
+        return counts
 
     @classmethod
-    def save(self):
-        self._db.save()
+    def import_csv(self, path: Path, mode: ImportMode = ImportMode.Append, action : ConstraintAction = ConstraintAction.Restrict) -> ImportReport:
+        if mode != ImportMode.Replace:
+            return self._db.import_csv(path, mode, validate = self.validate_frame)
+        # Program codes missing from the file are dropped, so their students are handled as in delete_record
+        program_codes = self._db.get_keys()
+        with transaction():
+            report = self._db.import_csv(path, mode, validate = self.validate_frame)
+            students = StudentDirectory._db.lookup_in('program_code', set(program_codes).difference(self._db.get_keys()))
+            report.cascaded = {EntryKind.STUDENT : 0}
+            match action:
+                case ConstraintAction.Cascade:
+                    report.cascaded[EntryKind.STUDENT] = StudentDirectory._db.delete_at(students)
+
+                case ConstraintAction.SetNull:
+                    report.cascaded[EntryKind.STUDENT] = StudentDirectory._db.update_at(students, {'program_code' : ''})
+
+                case ConstraintAction.Restrict:
+                    if len(students) > 0:
+                        raise DatabaseError(DatabaseErrorKind.REFERENCED_KEY,
+                                            f'The file leaves out program codes still used by {len(students)} student entries')
+        return report
+
+    @classmethod
+    def validate_frame(self, frame: pd.DataFrame) -> FrameValidation:
+        return ProgramEntry.validate_frame(frame, requires_all = True, college_directory = CollegeDirectory)
+
+    @classmethod
+    def batch(self):
+        return self._db.batch(validate = self.validate_frame)
+
+    @classmethod
+    def save(self) -> SaveStats:
+        return self._db.save()
 
 # Handles and stores college records
 class CollegeDirectory:
     _path = _get_data_dir() / 'colleges.csv'
-    _db   = GenericDatabase(_path, primary_key = 'college_code')
+    _db   = GenericDatabase(_path, primary_key = 'college_code', schema = CollegeEntry.get_fields())
 
     @staticmethod
     def get_entry_kind():
@@ -459,6 +1627,14 @@ class CollegeDirectory:
     def get_primary_key(self):
         return self._db.primary_key
     
+    @classmethod
+    def preload(self, progress: Callable[[float], None] = None):
+        self._db.load(progress)
+
+    @classmethod
+    def is_loaded(self) -> bool:
+        return self._db.is_loaded
+
     @classmethod
     def get_columns(self) -> List[str]:
         return self._db.get_columns()
@@ -476,12 +1652,35 @@ class CollegeDirectory:
     has_key = has_college
 
     @classmethod
-    def get_count(self, where: Union[str, Callable] = None) -> int:
+    def count_children(self, key: str) -> int:
+        # Programs under the college
+        return ProgramDirectory._db.count('college_code', key)
+
+    @classmethod
+    def children(self, key: str) -> List[dict]:
+        return ProgramDirectory._db.get_records_at(ProgramDirectory._db.lookup('college_code', key))
+
+    @classmethod
+    def count_students(self, key: str) -> int:
+        # Students of all the programs under the college
+        program_codes = ProgramDirectory._db.get_keys(ProgramDirectory._db.lookup('college_code', key))
+        return sum(ProgramDirectory.count_children(program_code) for program_code in program_codes)
+
+    @classmethod
+    def get_count(self, where: Union[str, Callable, Search, Predicate] = None) -> int:
         return self._db.get_count(where)
 
     @classmethod
-    def get_records(self, where : Union[str, Callable] = None, sorted: Sorted = None, paged : Paged = None) -> List[dict]:
+    def query(self, where: Union[str, Callable, Search, Predicate] = None, sorted: Sorted = None, paged: Paged = None) -> Tuple[int, List[dict]]:
+        return self._db.query(where = where, sorted = sorted, paged = paged)
+
+    @classmethod
+    def get_records(self, where : Union[str, Callable, Search, Predicate] = None, sorted: Sorted = None, paged : Paged = None) -> List[dict]:
         return self._db.get_records(where = where, sorted = sorted, paged = paged)
+
+    @classmethod
+    def stream(self, where: Union[str, Callable, Search, Predicate] = None, columns: List[str] = None, size: int = None) -> Iterator[List[dict]]:
+        return self._db.stream(where = where, columns = columns, size = size)
     
     @classmethod 
     def get_record(self, *, index : int = None, key : str = None) -> dict:
@@ -489,11 +1688,13 @@ class CollegeDirectory:
     
     @classmethod 
     def add_record(self, record : dict[str, str]):
-        CollegeEntry.validate_entry(record, requires_all = True)
+        # Inside a batch, added records are validated together when it commits
+        if not self._db.in_batch:
+            CollegeEntry.validate_entry(record, requires_all = True)
         self._db.add_record(record)
 
     @classmethod
-    def update_records(self, where: Union[str, Callable], updates: dict[str, str]):
+    def update_records(self, where: Union[str, Callable, Predicate], updates: dict[str, str]):
         CollegeEntry.validate_entry(updates, requires_all = False)
         self._db.update_records(where, updates)
 
@@ -502,49 +1703,156 @@ class CollegeDirectory:
         CollegeEntry.validate_entry(updates, requires_all = False)
         count = 1
         old_college_code = self.get_record(index = index, key = key)['college_code']
-        new_college_code = old_college_code
-        if 'college_code' in updates:
-            new_college_code = updates['college_code']
-        self._db.update_record(updates, index = index, key = key)
-        print('renaming ... 1')
-        if new_college_code != old_college_code:
-            print('renaming ... 2')
-            for program_record in ProgramDirectory.get_records(where = f'college_code == \'{old_college_code}\''):
+        new_college_code = updates.get('college_code', old_college_code)
+        renamed = new_college_code != old_college_code
+        if renamed and action == ConstraintAction.Restrict:
+            referencing = len(ProgramDirectory._db.lookup('college_code', old_college_code))
+            if referencing > 0:
+                raise DatabaseError(DatabaseErrorKind.CHANGE_KEY,
+                                    f'The college code \'{old_college_code}\' is still used by {referencing} program entries')
+        with transaction():
+            self._db.update_record(updates, index = index, key = key)
+            if renamed:
                 match action:
                     case ConstraintAction.Cascade:
-                        ProgramDirectory.update_record({'college_code' : new_college_code}, key = program_record['program_code'])
+                        count += ProgramDirectory._db.replace_values('college_code', old_college_code, new_college_code)
 
                     case ConstraintAction.SetNull:
-                        ProgramDirectory.update_record({'college_code' : ''}, key = program_record['program_code'])
-
-                    case ConstraintAction.Restrict:
-                        raise ValueError('...')
-                count = count + 1
+                        count += ProgramDirectory._db.replace_values('college_code', old_college_code, '')
         return count
 
     @classmethod
-    def delete_records(self, where: Union[str, Callable]):
+    def delete_records(self, where: Union[str, Callable, Predicate]):
         self._db.delete_records(where)
 
     @classmethod
-    def delete_record(self, *, index: int = None, key: str = None, action : ConstraintAction = ConstraintAction.Restrict):
-        count = 1
+    def delete_record(self, *, index: int = None, key: str = None, action : ConstraintAction = ConstraintAction.Restrict) -> dict[EntryKind, int]:
+        # Returns the number of rows deleted (or set to null) in each table
+        counts = {EntryKind.COLLEGE : 1, EntryKind.PROGRAM : 0, EntryKind.STUDENT : 0}
         college_code = self.get_record(index = index, key = key)['college_code']
-        for program_record in ProgramDirectory.get_records(where = f'college_code == \'{college_code}\''):
+        # The whole college -> programs -> students tree is resolved before anything is removed
+        programs = ProgramDirectory._db.lookup('college_code', college_code)
+        with transaction():
             match action:
                 # deletes all records referring to the same college_code
                 case ConstraintAction.Cascade:
-                    ProgramDirectory.delete_record(key = program_record['program_code'], action = action)
+                    students = StudentDirectory._db.lookup_in('program_code', ProgramDirectory._db.get_keys(programs))
+                    counts[EntryKind.STUDENT] = StudentDirectory._db.delete_at(students)
+                    counts[EntryKind.PROGRAM] = ProgramDirectory._db.delete_at(programs)
 
                 case ConstraintAction.SetNull:
-                    ProgramDirectory.update_record({'college_code' : ''}, key = program_record['program_code'], action = action)
+                    counts[EntryKind.PROGRAM] = ProgramDirectory._db.update_at(programs, {'college_code' : ''})
 
                 case ConstraintAction.Restrict:
-                    raise ValueError('...')
-            count = count + 1
-        self._db.delete_record(index = index, key = key)
-        return count
+                    if len(programs) > 0:
+                        raise DatabaseError(DatabaseErrorKind.REFERENCED_KEY,
+                                            f'The college code \'{college_code}\' is still used by {len(programs)} program entries')
+            self._db.delete_record(index = index, key = key)
+        return counts
 
     @classmethod
-    def save(self):
-        self._db.save()
\ No newline at end of file
+    def import_csv(self, path: Path, mode: ImportMode = ImportMode.Append, action : ConstraintAction = ConstraintAction.Restrict) -> ImportReport:
+        if mode != ImportMode.Replace:
+            return self._db.import_csv(path, mode, validate = self.validate_frame)
+        # College codes missing from the file are dropped, so their programs are handled as in delete_record
+        college_codes = self._db.get_keys()
+        with transaction():
+            report = self._db.import_csv(path, mode, validate = self.validate_frame)
+            programs = ProgramDirectory._db.lookup_in('college_code', set(college_codes).difference(self._db.get_keys()))
+            report.cascaded = {EntryKind.PROGRAM : 0, EntryKind.STUDENT : 0}
+            match action:
+                case ConstraintAction.Cascade:
+                    students = StudentDirectory._db.lookup_in('program_code', ProgramDirectory._db.get_keys(programs))
+                    report.cascaded[EntryKind.STUDENT] = StudentDirectory._db.delete_at(students)
+                    report.cascaded[EntryKind.PROGRAM] = ProgramDirectory._db.delete_at(programs)
+
+                case ConstraintAction.SetNull:
+                    report.cascaded[EntryKind.PROGRAM] = ProgramDirectory._db.update_at(programs, {'college_code' : ''})
+
+                case ConstraintAction.Restrict:
+                    if len(programs) > 0:
+                        raise DatabaseError(DatabaseErrorKind.REFERENCED_KEY,
+                                            f'The file leaves out college codes still used by {len(programs)} program entries')
+        return report
+
+    @classmethod
+    def validate_frame(self, frame: pd.DataFrame) -> FrameValidation:
+        return CollegeEntry.validate_frame(frame, requires_all = True)
+
+    @classmethod
+    def batch(self):
+        return self._db.batch(validate = self.validate_frame)
+
+    @classmethod
+    def save(self) -> SaveStats:
+        return self._db.save()
+
+def _dangling_positions(child: GenericDatabase, column: str, parent: GenericDatabase) -> np.ndarray:
+    # Rows of the child whose (non-empty) foreign key is not a key of the parent
+    if child.df.empty or column not in child.df.columns:
+        return np.empty(0, dtype = np.intp)
+    values = child.df[column]
+    dangling = values.notna() & (values != '') & ~values.isin(parent.get_keys())
+    return np.flatnonzero(dangling.to_numpy(dtype = bool))
+
+def _malformed_id_positions() -> np.ndarray:
+    # IDs must read 20XX-XXXX; checked on a matrix of character codes rather than with a regex per row
+    df = StudentDirectory._db.df
+    if df.empty or 'id' not in df.columns:
+        return np.empty(0, dtype = np.intp)
+    chars = df['id'].to_numpy().astype('U')
+    width = chars.dtype.itemsize // 4
+    if width < 9:
+        return np.arange(len(chars))
+    codes = chars.view(np.uint32).reshape(len(chars), width)
+    digits = (codes >= ord('0')) & (codes <= ord('9'))
+    valid = ((codes[:, 0] == ord('2')) & (codes[:, 1] == ord('0')) & digits[:, 2] & digits[:, 3]
+             & (codes[:, 4] == ord('-')) & digits[:, 5:9].all(axis = 1))
+    if width > 9:
+        valid &= (codes[:, 9:] == 0).all(axis = 1)
+    return np.flatnonzero(~valid)
+
+# Checks all three directories for dangling foreign keys, duplicate primary keys and malformed student IDs.
+# With Cascade the offending rows are deleted, with SetNull dangling foreign keys are cleared
+# (malformed IDs are kept, as a key can't be null), and with Restrict any problem raises an error
+def integrity_report(repair: ConstraintAction = None) -> IntegrityReport:
+    start = time.perf_counter()
+    students, programs, colleges = StudentDirectory._db, ProgramDirectory._db, CollegeDirectory._db
+
+    def counts(db: GenericDatabase, column: str, positions: np.ndarray) -> dict[str, int]:
+        return db.df[column].take(positions).astype(str).value_counts().to_dict()
+
+    report = IntegrityReport(
+        dangling_program_codes = counts(students, 'program_code', _dangling_positions(students, 'program_code', programs)),
+        dangling_college_codes = counts(programs, 'college_code', _dangling_positions(programs, 'college_code', colleges)),
+        duplicate_keys = {kind : list(dict.fromkeys(db.get_keys(db.duplicate_key_positions())))
+                          for kind, db in ((EntryKind.STUDENT, students), (EntryKind.PROGRAM, programs), (EntryKind.COLLEGE, colleges))},
+        malformed_ids = students.get_keys(_malformed_id_positions()))
+
+    match repair:
+        case ConstraintAction.Restrict:
+            if not report.is_clean():
+                raise DatabaseError(DatabaseErrorKind.INTEGRITY_VIOLATION)
+
+        case ConstraintAction.Cascade | ConstraintAction.SetNull:
+            repaired = {EntryKind.STUDENT : 0, EntryKind.PROGRAM : 0, EntryKind.COLLEGE : 0}
+            for kind, db in ((EntryKind.STUDENT, students), (EntryKind.PROGRAM, programs), (EntryKind.COLLEGE, colleges)):
+                repaired[kind] += db.drop_duplicate_keys()
+            # Programs first, so students of a program removed by the cascade are caught as dangling below
+            if repair == ConstraintAction.Cascade:
+                repaired[EntryKind.PROGRAM] += programs.delete_at(_dangling_positions(programs, 'college_code', colleges))
+                repaired[EntryKind.STUDENT] += students.delete_at(_dangling_positions(students, 'program_code', programs))
+                repaired[EntryKind.STUDENT] += students.delete_at(_malformed_id_positions())
+            else:
+                repaired[EntryKind.PROGRAM] += programs.update_at(_dangling_positions(programs, 'college_code', colleges), {'college_code' : ''})
+                repaired[EntryKind.STUDENT] += students.update_at(_dangling_positions(students, 'program_code', programs), {'program_code' : ''})
+            report.repaired = repaired
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+# One batch over all three directories, committed or rolled back together
+def transaction():
+    return _batched((CollegeDirectory._db, CollegeDirectory.validate_frame),
+                    (ProgramDirectory._db, ProgramDirectory.validate_frame),
+                    (StudentDirectory._db, StudentDirectory.validate_frame))
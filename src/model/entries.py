@@ -1,5 +1,8 @@
 from enum import Enum
 from dataclasses import dataclass 
+from typing import Optional
+
+import pandas as pd
 
 from src.model.errors import ValidationError, ValidationErrorKind
 
@@ -8,6 +11,7 @@ class FieldInfo:
     internal_name : str
     display_name : str
     underlying_type : type
+    categorical : bool = False # few distinct values (e.g. foreign keys), stored as a category
 
 class EntryKind(Enum):
     STUDENT = 'Student'
@@ -28,13 +32,67 @@ class GenderKind(Enum):
     FEMALE = 'Female'
     OTHER = 'Other'
 
+# Result of validating a whole frame of entries at once, one cell per row and field
+@dataclass
+class FrameValidation:
+    entry_kind : EntryKind
+    errors : pd.DataFrame   # True where the field of that row breaks a rule
+    kinds : pd.DataFrame    # ValidationErrorKind of the first rule broken, missing where valid
+    messages : pd.DataFrame # message of the first rule broken, missing where valid
+
+    @staticmethod
+    def Empty(entry_kind : EntryKind, index : pd.Index, field_kinds) -> FrameValidation:
+        columns = [field_kind.value.internal_name for field_kind in field_kinds]
+        return FrameValidation(entry_kind,
+                               pd.DataFrame(False, index = index, columns = columns),
+                               pd.DataFrame(None, index = index, columns = columns, dtype = object),
+                               pd.DataFrame(None, index = index, columns = columns, dtype = object))
+
+    def fail(self, field_kind, mask : pd.Series, error_kind : ValidationErrorKind, message : str):
+        # Only the first rule a cell breaks is kept, as validate_field stops at the first one
+        column = field_kind.value.internal_name
+        mask = mask.fillna(True).astype(bool) & ~self.errors[column]
+        if not mask.any():
+            return
+        self.errors.loc[mask, column] = True
+        self.kinds.loc[mask, column] = error_kind
+        self.messages.loc[mask, column] = message
+
+    @property
+    def valid(self) -> pd.Series:
+        return ~self.errors.any(axis = 1)
+
+    def is_valid(self) -> bool:
+        return not self.errors.to_numpy().any()
+
+    def error_of(self, row) -> Optional[ValidationError]:
+        # The first failing field of a row, as the error validate_entry would have raised
+        for column in self.errors.columns:
+            if self.errors.at[row, column]:
+                field_kind = self.entry_kind.get_entry_type().FieldKind.from_internal_name(column)
+                return ValidationError(self.entry_kind, field_kind, self.kinds.at[row, column], self.messages.at[row, column])
+        return None
+
+def _text(df : pd.DataFrame, column : str) -> pd.Series:
+    return df[column].astype('string').fillna('')
+
+def _check_columns(result : FrameValidation, df : pd.DataFrame, field_kinds, requires_all : bool) -> list:
+    # Fields present in the frame; absent ones fail every row only if all fields are required
+    present = []
+    for field_kind in field_kinds:
+        if field_kind.value.internal_name in df.columns:
+            present.append(field_kind)
+        elif requires_all:
+            result.fail(field_kind, pd.Series(True, index = df.index), ValidationErrorKind.MISSING_FIELD, 'The given input is missing some fields')
+    return present
+
 @dataclass
 class StudentEntry:
     class FieldKind(Enum):
-        ID = FieldInfo(internal_name = 'id', display_name = 'ID Number', underlying_type = int)
+        ID = FieldInfo(internal_name = 'id', display_name = 'ID Number', underlying_type = str)
         FIRST_NAME = FieldInfo(internal_name = 'first_name', display_name = 'First Name', underlying_type = str)
         LAST_NAME = FieldInfo(internal_name = 'last_name', display_name = 'Last Name', underlying_type = str)
-        PROGRAM_CODE = FieldInfo(internal_name = 'program_code', display_name = 'Program Code', underlying_type = str)
+        PROGRAM_CODE = FieldInfo(internal_name = 'program_code', display_name = 'Program Code', underlying_type = str, categorical = True)
         YEAR = FieldInfo(internal_name = 'year', display_name = 'Year Level', underlying_type = int)
         GENDER = FieldInfo(internal_name = 'gender', display_name = 'Gender', underlying_type = GenderKind)
 
@@ -124,11 +182,46 @@ class StudentEntry:
                     continue
             StudentEntry.validate_field(field_kind, entry[field_kind.value.internal_name], program_directory)
 
+    @staticmethod
+    def validate_frame(df : pd.DataFrame, requires_all = False, program_directory = None) -> FrameValidation:
+        # Same rules as validate_field, applied to whole columns
+        result = FrameValidation.Empty(EntryKind.STUDENT, df.index, StudentEntry.FieldKind)
+        present = _check_columns(result, df, StudentEntry.FieldKind, requires_all)
+        if df.empty:
+            return result # No rows to fail, and str.partition() gives no columns at all for an empty frame
+        for field_kind in present:
+            name = field_kind.value.internal_name
+            if field_kind == StudentEntry.FieldKind.YEAR:
+                year = pd.to_numeric(df[name], errors = 'coerce')
+                result.fail(field_kind, year.isna() | (year % 1 != 0), ValidationErrorKind.INVALID_FORMAT, 'The input is not a digit')
+                result.fail(field_kind, (year < 1) | (year > 4), ValidationErrorKind.INVALID_FORMAT, 'The year must be from 1 to 4')
+                continue
+
+            text = _text(df, name)
+            result.fail(field_kind, text.str.len() == 0, ValidationErrorKind.MISSING_FIELD, field_kind.value.display_name + ' Input is empty')
+            match field_kind:
+                case StudentEntry.FieldKind.ID:
+                    result.fail(field_kind, text.str.count('-') != 1, ValidationErrorKind.INVALID_FORMAT, 'ID Number must contain exactly one \'-\'')
+                    parts = text.str.partition('-')
+                    for part in (parts[0], parts[2]):
+                        result.fail(field_kind, part.str.len() != 4, ValidationErrorKind.INVALID_FORMAT, 'ID Number must be in format 20XX-XXXX')
+                        result.fail(field_kind, ~part.str.isdigit(), ValidationErrorKind.INVALID_FORMAT, 'ID Number must be in digits')
+                    result.fail(field_kind, ~parts[0].str.startswith('20'), ValidationErrorKind.INVALID_FORMAT, 'ID Number must start with 20XX')
+
+                case StudentEntry.FieldKind.PROGRAM_CODE:
+                    if program_directory is not None:
+                        programs = set(program_directory.get_programs())
+                        result.fail(field_kind, ~text.isin(programs), ValidationErrorKind.FOREIGN_KEY_MISSING, 'The given program code does not exist')
+
+                case StudentEntry.FieldKind.GENDER:
+                    result.fail(field_kind, ~text.isin([gender.value for gender in GenderKind]), ValidationErrorKind.INVALID_FORMAT, 'Not a valid option')
+        return result
+
 class ProgramEntry:
     class FieldKind(Enum):
         PROGRAM_CODE = FieldInfo(internal_name = 'program_code', display_name = 'Program Code', underlying_type = str)
         PROGRAM_NAME = FieldInfo(internal_name = 'program_name', display_name = 'Program Name', underlying_type = str)
-        COLLEGE_CODE = FieldInfo(internal_name = 'college_code', display_name = 'College Code', underlying_type = str)
+        COLLEGE_CODE = FieldInfo(internal_name = 'college_code', display_name = 'College Code', underlying_type = str, categorical = True)
 
         @staticmethod
         def from_internal_name(name : str) -> ProgramEntry.FieldKind:
@@ -173,6 +266,17 @@ class ProgramEntry:
                     continue
             ProgramEntry.validate_field(field_kind, entry[field_kind.value.internal_name], college_directory)
 
+    @staticmethod
+    def validate_frame(df : pd.DataFrame, requires_all = False, college_directory = None) -> FrameValidation:
+        result = FrameValidation.Empty(EntryKind.PROGRAM, df.index, ProgramEntry.FieldKind)
+        for field_kind in _check_columns(result, df, ProgramEntry.FieldKind, requires_all):
+            text = _text(df, field_kind.value.internal_name)
+            result.fail(field_kind, text.str.len() == 0, ValidationErrorKind.MISSING_FIELD, field_kind.value.display_name + ' Input is empty')
+            if field_kind == ProgramEntry.FieldKind.COLLEGE_CODE and college_directory is not None:
+                colleges = set(college_directory.get_colleges())
+                result.fail(field_kind, ~text.isin(colleges), ValidationErrorKind.FOREIGN_KEY_MISSING, 'The given college code does not exist')
+        return result
+
 class CollegeEntry:
     class FieldKind(Enum):
         COLLEGE_CODE = FieldInfo(internal_name = 'college_code', display_name = 'College Code', underlying_type = str)
@@ -222,4 +326,16 @@ class CollegeEntry:
                                           'The given input is missing some fields')
                 else:
                     continue
-            CollegeEntry.validate_field(field_kind, entry[field_kind.value.internal_name])
\ No newline at end of file
+            CollegeEntry.validate_field(field_kind, entry[field_kind.value.internal_name])
+
+    @staticmethod
+    def validate_frame(df : pd.DataFrame, requires_all = False) -> FrameValidation:
+        result = FrameValidation.Empty(EntryKind.COLLEGE, df.index, CollegeEntry.FieldKind)
+        for field_kind in _check_columns(result, df, CollegeEntry.FieldKind, requires_all):
+            text = _text(df, field_kind.value.internal_name)
+            result.fail(field_kind, text.str.len() == 0, ValidationErrorKind.MISSING_FIELD, field_kind.value.display_name + ' Input is empty')
+            if field_kind == CollegeEntry.FieldKind.COLLEGE_CODE:
+                # Must be in one word and all capitals
+                result.fail(field_kind, ~text.str.fullmatch(r'\s*\S+\s*'), ValidationErrorKind.INVALID_FORMAT, 'The college code must contain exactly one word')
+                result.fail(field_kind, ~text.str.isupper(), ValidationErrorKind.INVALID_FORMAT, 'The college code must be in uppercase')
+        return result
@@ -10,6 +10,9 @@ class DatabaseErrorKind(Enum):
     NO_KEY = 'An entry with key does not exist'
     DUPLICATE_KEY = 'The key already exists'
     CHANGE_KEY = 'The key cannot be changed'
+    REFERENCED_KEY = 'The key is still referenced by other entries'
+    INTEGRITY_VIOLATION = 'Some entries break referential integrity'
+    READ_ONLY = 'The database is read-only'
     HEADER_NAME_NOT_FOUND = 'Header name not found'
 
 class DatabaseError(Exception):
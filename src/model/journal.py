@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA:
+        return None
+    return str(value)
+
+# Append-only log of the inserts, updates and deletes made to a CSV database
+# since it was last written to disk
+class Journal:
+    def __init__(self, csv_path: Path):
+        self.csv_path = csv_path
+        self.path = csv_path.with_name(csv_path.name + '.journal')
+        # Journal being folded into the CSV by a compaction
+        self.sealed_path = csv_path.with_name(csv_path.name + '.journal.sealed')
+        self.entry_count = 0
+        self._lock = threading.Lock()
+
+    def append(self, entry: dict):
+        line = json.dumps(entry, default = _to_json, ensure_ascii = False)
+        with self._lock:
+            with open(self.path, 'a', encoding = 'utf-8') as f:
+                f.write(line + '\n')
+            self.entry_count += 1
+
+    def append_many(self, entries: list):
+        lines = ''.join(json.dumps(entry, default = _to_json, ensure_ascii = False) + '\n' for entry in entries)
+        with self._lock:
+            with open(self.path, 'a', encoding = 'utf-8') as f:
+                f.write(lines)
+            self.entry_count += len(entries)
+
+    def is_empty(self) -> bool:
+        # True when every write is already in the CSV
+        return not any(path.exists() and path.stat().st_size > 0 for path in (self.path, self.sealed_path))
+
+    def read(self) -> Iterator[dict]:
+        paths = []
+        if self.sealed_path.exists():
+            # A sealed journal older than the CSV was already compacted into it
+            if self.csv_path.exists() and self.csv_path.stat().st_mtime_ns > self.sealed_path.stat().st_mtime_ns:
+                self.sealed_path.unlink()
+            else:
+                paths.append(self.sealed_path)
+        if self.path.exists():
+            paths.append(self.path)
+        for path in paths:
+            with open(path, encoding = 'utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn line left by an interrupted append
+                        continue
+                    self.entry_count += 1
+                    yield entry
+            self._terminate_last_line(path)
+
+    def _terminate_last_line(self, path: Path):
+        # Keeps the next append from being glued onto a torn final line
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    def seal(self) -> bool:
+        # Moves the live entries aside so new ones start a fresh file while they are compacted
+        with self._lock:
+            if self.path.exists():
+                if self.sealed_path.exists():
+                    with open(self.sealed_path, 'a', encoding = 'utf-8') as sealed, open(self.path, encoding = 'utf-8') as live:
+                        sealed.write(live.read())
+                    self.path.unlink()
+                else:
+                    os.replace(self.path, self.sealed_path)
+            if not self.sealed_path.exists():
+                return False
+            # Stamped now, so only a CSV written after sealing counts as containing these entries
+            os.utime(self.sealed_path)
+            self.entry_count = 0
+            return True
+
+    def discard_sealed(self):
+        with self._lock:
+            self.sealed_path.unlink(missing_ok = True)
@@ -0,0 +1,256 @@
+import ast
+import io
+import threading
+import tokenize
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.model.errors import DatabaseError, DatabaseErrorKind
+
+# Structured filters for GenericDatabase. Each one compiles straight to a boolean
+# mask over the rows, using the column indexes and search arrays where it can,
+# and is hashable so its result can be cached like a query string
+@dataclass(frozen = True)
+class Predicate:
+    def mask(self, db) -> np.ndarray:
+        raise NotImplementedError
+
+    def __and__(self, other: 'Predicate') -> 'Predicate':
+        return And(self, other)
+
+    def __or__(self, other: 'Predicate') -> 'Predicate':
+        return Or(self, other)
+
+    def __invert__(self) -> 'Predicate':
+        return Not(self)
+
+def _column(db, column: str) -> pd.Series:
+    if column not in db.df.columns:
+        raise DatabaseError(DatabaseErrorKind.HEADER_NAME_NOT_FOUND,
+                            f'Column \'{column}\' does not exist for filtering')
+    return db.df[column]
+
+def _positions_mask(db, positions: np.ndarray) -> np.ndarray:
+    mask = np.zeros(len(db.df), dtype = bool)
+    mask[positions] = True
+    return mask
+
+def _comparable(values: pd.Series) -> pd.Series:
+    # Categories are unordered, so compare the values themselves
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(values.cat.categories.dtype)
+    return values
+
+def _to_mask(result: pd.Series) -> np.ndarray:
+    # Missing values never match
+    return result.fillna(False).to_numpy(dtype = bool)
+
+@dataclass(frozen = True)
+class Eq(Predicate):
+    column: str
+    value: Any
+
+    def mask(self, db) -> np.ndarray:
+        _column(db, self.column)
+        return _positions_mask(db, db.lookup(self.column, self.value))
+
+@dataclass(frozen = True)
+class In(Predicate):
+    column: str
+    values: tuple
+
+    def __post_init__(self):
+        # Any iterable is accepted, kept as a tuple so the predicate stays hashable
+        object.__setattr__(self, 'values', tuple(self.values))
+
+    def mask(self, db) -> np.ndarray:
+        _column(db, self.column)
+        return _positions_mask(db, db.lookup_in(self.column, self.values))
+
+@dataclass(frozen = True)
+class Contains(Predicate):
+    column: str
+    text: str
+    case: bool = False
+
+    def mask(self, db) -> np.ndarray:
+        values = _column(db, self.column)
+        if not self.case:
+            return _positions_mask(db, db.search(self.text, self.column))
+        return _to_mask(values.astype(str).str.contains(self.text, regex = False))
+
+@dataclass(frozen = True)
+class StartsWith(Predicate):
+    column: str
+    prefix: str
+    case: bool = False
+
+    def mask(self, db) -> np.ndarray:
+        values = _column(db, self.column)
+        if not self.case:
+            return _positions_mask(db, db.search_prefix(self.prefix, self.column))
+        return _to_mask(values.astype(str).str.startswith(self.prefix))
+
+@dataclass(frozen = True)
+class Range(Predicate):
+    column: str
+    low: Optional[Any] = None  # inclusive, unbounded if None
+    high: Optional[Any] = None # inclusive, unbounded if None
+
+    def mask(self, db) -> np.ndarray:
+        values = _comparable(_column(db, self.column))
+        result = pd.Series(True, index = values.index)
+        if self.low is not None:
+            result &= values >= self.low
+        if self.high is not None:
+            result &= values <= self.high
+        return _to_mask(result)
+
+@dataclass(frozen = True, init = False)
+class And(Predicate):
+    predicates: tuple
+
+    def __init__(self, *predicates: Predicate):
+        object.__setattr__(self, 'predicates', predicates)
+
+    def mask(self, db) -> np.ndarray:
+        result = np.ones(len(db.df), dtype = bool)
+        for predicate in self.predicates:
+            # Once nothing matches, the remaining terms cannot change the result
+            if not result.any():
+                break
+            result &= predicate.mask(db)
+        return result
+
+@dataclass(frozen = True, init = False)
+class Or(Predicate):
+    predicates: tuple
+
+    def __init__(self, *predicates: Predicate):
+        object.__setattr__(self, 'predicates', predicates)
+
+    def mask(self, db) -> np.ndarray:
+        result = np.zeros(len(db.df), dtype = bool)
+        for predicate in self.predicates:
+            if result.all():
+                break
+            result |= predicate.mask(db)
+        return result
+
+@dataclass(frozen = True)
+class Not(Predicate):
+    predicate: Predicate
+
+    def mask(self, db) -> np.ndarray:
+        return ~self.predicate.mask(db)
+
+# Query strings are planned once per shape, with their literals taken out as
+# parameters, so 'program_code == "A"' and 'program_code == "B"' share a plan
+PLAN_CACHE_SIZE = 256
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+def _literal(node: ast.AST):
+    # Placeholder names stand for the literals cut out of the string
+    if isinstance(node, ast.Name) and node.id.startswith('_literal_'):
+        return lambda params, i = int(node.id[len('_literal_'):]): params[i]
+    if isinstance(node, ast.Constant) and node.value in (True, False, None):
+        return lambda params, value = node.value: value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        operand = _literal(node.operand)
+        return lambda params: -operand(params)
+    raise SyntaxError('not a literal')
+
+def _literal_list(node: ast.AST):
+    if not isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        raise SyntaxError('not a list of literals')
+    items = [_literal(item) for item in node.elts]
+    return lambda params: tuple(item(params) for item in items)
+
+def _compare(column: str, op: ast.cmpop, value: ast.AST):
+    if isinstance(op, (ast.In, ast.NotIn)):
+        values = _literal_list(value)
+        plan = lambda params: In(column, values(params))
+        return plan if isinstance(op, ast.In) else lambda params: Not(plan(params))
+    value = _literal(value)
+    match op:
+        case ast.Eq():
+            return lambda params: Eq(column, value(params))
+        case ast.NotEq():
+            return lambda params: Not(Eq(column, value(params)))
+        case ast.GtE():
+            return lambda params: Range(column, low = value(params))
+        case ast.LtE():
+            return lambda params: Range(column, high = value(params))
+        case ast.Gt():
+            return lambda params: And(Range(column, low = value(params)), Not(Eq(column, value(params))))
+        case ast.Lt():
+            return lambda params: And(Range(column, high = value(params)), Not(Eq(column, value(params))))
+    raise SyntaxError('unsupported comparison')
+
+_FLIPPED = {ast.Eq : ast.Eq, ast.NotEq : ast.NotEq, ast.Lt : ast.Gt, ast.Gt : ast.Lt, ast.LtE : ast.GtE, ast.GtE : ast.LtE}
+
+def _plan(node: ast.AST):
+    # Builds a function from the literal values to the predicate the string describes
+    if isinstance(node, ast.BoolOp) or (isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr))):
+        operands = [_plan(operand) for operand in (node.values if isinstance(node, ast.BoolOp) else [node.left, node.right])]
+        combine = And if isinstance(node.op, (ast.And, ast.BitAnd)) else Or
+        return lambda params: combine(*(operand(params) for operand in operands))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+        operand = _plan(node.operand)
+        return lambda params: Not(operand(params))
+    if isinstance(node, ast.Compare):
+        terms = []
+        left = node.left
+        # A chain such as 'low <= year <= high' is the conjunction of its links
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(left, ast.Name) and not left.id.startswith('_literal_'):
+                terms.append(_compare(left.id, op, right))
+            elif isinstance(right, ast.Name) and not right.id.startswith('_literal_') and type(op) in _FLIPPED:
+                terms.append(_compare(right.id, _FLIPPED[type(op)](), left))
+            else:
+                raise SyntaxError('unsupported comparison')
+            left = right
+        if len(terms) == 1:
+            return terms[0]
+        return lambda params: And(*(term(params) for term in terms))
+    raise SyntaxError('unsupported expression')
+
+def compile_where(where: str) -> Optional[Predicate]:
+    # The predicate equivalent to a query string, or None if it needs pandas to evaluate it
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(where).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    literals = []
+    shape = []
+    for token in tokens:
+        if token.type in (tokenize.STRING, tokenize.NUMBER):
+            shape.append((tokenize.NAME, f'_literal_{len(literals)}'))
+            literals.append(token.string)
+        elif token.type not in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER, tokenize.COMMENT):
+            shape.append((token.type, token.string))
+    shape = tuple(shape)
+    with _plans_lock:
+        plan = _plans.get(shape, False)
+        if plan is not False:
+            _plans.move_to_end(shape)
+    if plan is False:
+        try:
+            plan = _plan(ast.parse(tokenize.untokenize(shape), mode = 'eval').body)
+        except (SyntaxError, ValueError):
+            plan = None # remembered too, so the shape is not parsed again
+        with _plans_lock:
+            _plans[shape] = plan
+            if len(_plans) > PLAN_CACHE_SIZE:
+                _plans.popitem(last = False)
+    if plan is None:
+        return None
+    try:
+        return plan(tuple(ast.literal_eval(literal) for literal in literals))
+    except (SyntaxError, ValueError):
+        return None
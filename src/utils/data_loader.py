@@ -0,0 +1,25 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from src.model.database import StudentDirectory, ProgramDirectory, CollegeDirectory
+
+# Parses and indexes every directory off the GUI thread
+class DataLoader(QThread):
+    progress = pyqtSignal(int)
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.directories = [CollegeDirectory, ProgramDirectory, StudentDirectory]
+
+    def run(self):
+        # Each directory's share of the bar follows its file size
+        sizes = [directory._path.stat().st_size if directory._path.exists() else 0 for directory in self.directories]
+        total = max(sum(sizes), 1)
+        done = 0
+        try:
+            for directory, size in zip(self.directories, sizes):
+                directory.preload(lambda fraction, done = done, size = size: self.progress.emit(int(100 * (done + fraction * size) / total)))
+                done += size
+        except Exception:
+            # Left unloaded, the directory is loaded again on the GUI thread where its error can be shown
+            return
+        self.progress.emit(100)
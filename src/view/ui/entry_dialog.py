@@ -246,7 +246,7 @@ class EntryDialog(QDialog):
 
             case EntryKind.PROGRAM:
                 # Number of Students
-                count = StudentDirectory.get_count(where = f'program_code == \'{self.record['program_code']}\'')
+                count = ProgramDirectory.count_children(self.record['program_code'])
                 student_count_field = self.create_field_info_widget('Number of Students', f'{count}')
 
                 # College
@@ -260,11 +260,11 @@ class EntryDialog(QDialog):
 
             case EntryKind.COLLEGE:
                 # Number of Programs
-                program_records = ProgramDirectory.get_records(where = f'college_code == \'{self.record['college_code']}\'')
-                program_count_field = self.create_field_info_widget('Number of Programs', f'{len(program_records)}')
+                program_count = CollegeDirectory.count_children(self.record['college_code'])
+                program_count_field = self.create_field_info_widget('Number of Programs', f'{program_count}')
 
                 # Number of Students
-                student_count = sum(StudentDirectory.get_count(where = f'program_code == \'{program_record['program_code']}\'') for program_record in program_records)
+                student_count = CollegeDirectory.count_students(self.record['college_code'])
                 student_count_field = self.create_field_info_widget('Number of Students', f'{student_count}')
 
                 second_grid_layout.addLayout(program_count_field, 0, 0, 1, 1)
@@ -407,10 +407,8 @@ class EntryDialog(QDialog):
         new_key_value = new_data[primary_key]
         count = 0
         if old_key_value != new_key_value:
-            if self.current_db.get_entry_kind() == EntryKind.PROGRAM:
-                count = StudentDirectory.get_count(where = f'program_code == \'{old_key_value}\'')
-            elif self.current_db.get_entry_kind() == EntryKind.COLLEGE:
-                count = ProgramDirectory.get_count(where = f'college_code == \'{old_key_value}\'')
+            if self.current_db.get_entry_kind() in (EntryKind.PROGRAM, EntryKind.COLLEGE):
+                count = self.current_db.count_children(old_key_value)
         if count > 0:
             result = self.confirm_rename_changes(count, old_key_value, new_key_value)
             if result == int(QMessageBox.StandardButton.Yes) or result == QMessageBox.StandardButton.Yes:
@@ -426,19 +424,15 @@ class EntryDialog(QDialog):
         input_data = self.get_data()
         if self.current_db.get_entry_kind() == EntryKind.PROGRAM:
             old_program_code = self.record['program_code']
-            count = StudentDirectory.get_count(where = f'program_code == \'{old_program_code}\'')
+            count = ProgramDirectory.count_children(old_program_code)
             if count > 0:
                 message += f'\nThis also means deleting {count} student entries with program code {old_program_code}.'
         elif self.current_db.get_entry_kind() == EntryKind.COLLEGE:
             old_college_code = self.record['college_code']
-            program_list = ProgramDirectory.get_records(where = f'college_code == \'{old_college_code}\'')
-            program_count = len(program_list)
+            program_count = CollegeDirectory.count_children(old_college_code)
             if program_count > 0:
                 message += f'\nThis also means deleting {program_count} program entries with college code {old_college_code}.'
-                count = 0
-                for program_entry in program_list:
-                    student_count = StudentDirectory.get_count(where = f'program_code == \'{program_entry['program_code']}\'')
-                    count = count + student_count
+                count = CollegeDirectory.count_students(old_college_code)
                 if count > 0:
                     message += f'\nThis also means deleting {count} student entries associated with the college code.'
         msg = MessageBox(self, title = 'Confirm Delete', message = message)
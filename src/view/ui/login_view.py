@@ -46,6 +46,9 @@ class LoginForm(Card):
         self.login_button.setStyleSheet(Styles.action_button(back_color = Constants.LOGIN_BUTTON_COLOR))
         self.login_button.setCursor(Qt.CursorShape.PointingHandCursor)
         self.login_button.clicked.connect(self.handle_login)
+        # Enabled once the directories have finished loading
+        self.login_button.setEnabled(False)
+        self.login_button.setText('Loading...')
 
         # Layout
         login_layout.addWidget(TitleLabel('Select a Role', 24), alignment = Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignTop)
@@ -53,6 +56,13 @@ class LoginForm(Card):
         login_layout.addStretch()
         login_layout.addWidget(self.login_button)
 
+    def set_loading_progress(self, percent : int):
+        self.login_button.setText(f'Loading... {percent}%')
+
+    def set_ready(self):
+        self.login_button.setText('Login')
+        self.login_button.setEnabled(True)
+
     def handle_login(self):
         selected_role = self.role_toggle_area.get_role()
         self.login_signal.emit(selected_role)
@@ -87,4 +97,12 @@ class LoginView(QWidget):
         layout.addSpacing(20)
         layout.addWidget(self.login_card, alignment = Qt.AlignmentFlag.AlignCenter)
         layout.addSpacing(20)
-        layout.addStretch()
\ No newline at end of file
+        layout.addStretch()
+
+    @pyqtSlot(int)
+    def set_loading_progress(self, percent : int):
+        self.login_card.set_loading_progress(percent)
+
+    @pyqtSlot()
+    def set_ready(self):
+        self.login_card.set_ready()
\ No newline at end of file
@@ -9,6 +9,7 @@ from PyQt6.QtGui import QIcon
 from src.model.role import UserRole
 from src.utils.font_loader import FontLoader
 from src.utils.icon_loader import IconLoader
+from src.utils.data_loader import DataLoader
 from src.view.ui.login_view import LoginView
 from src.view.ui.working_view import WorkingView
 
@@ -37,6 +38,14 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(self.container)
 
         self.login_view = LoginView()
+
+        # Directories are parsed in the background while the login view is up. Started before the
+        # working view is built, which only reads the CSV headers, so no table is loaded on this thread
+        self.data_loader = DataLoader(self)
+        self.data_loader.progress.connect(self.login_view.set_loading_progress)
+        self.data_loader.finished.connect(self.login_view.set_ready)
+        self.data_loader.start()
+
         self.working_view = WorkingView()
 
         self.container.addWidget(self.login_view)
@@ -47,10 +56,18 @@ class MainWindow(QMainWindow):
 
     @pyqtSlot(UserRole)
     def on_login(self, role : UserRole):
+        # Login is only enabled once loading has finished, so this normally returns at once
+        self.data_loader.wait()
         self.working_view.set_role(role)
+        self.working_view.body.fetch_data()
         self.container.setCurrentIndex(1)
 
     @pyqtSlot()
     def on_logout(self):
         self.working_view.set_default()
-        self.container.setCurrentIndex(0)
\ No newline at end of file
+        self.container.setCurrentIndex(0)
+
+    def closeEvent(self, event):
+        # The loader thread must not outlive the window
+        self.data_loader.wait()
+        super().closeEvent(event)
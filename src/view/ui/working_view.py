@@ -1,4 +1,5 @@
 import math
+from typing import Optional
 from PyQt6.QtWidgets import (
     QAbstractItemView,
     QComboBox,
@@ -30,7 +31,9 @@ from src.model.database import (
     ProgramDirectory, 
     CollegeDirectory, 
     ConstraintAction, 
+    Cursor,
     Paged, 
+    Search,
     Sorted
 )
 from src.model.table_model import DirectoryTableModel
@@ -203,6 +206,8 @@ class PaginationArea(QWidget):
         self.items_per_page = items_per_page
         self.current_page = 0
         self.total_rows = 0
+        # Cursor each page continues from, known for the pages reached by stepping forward
+        self.cursors = {0 : None}
 
         self.setStyleSheet(Styles.pagination_area())
         self.setup_ui()
@@ -233,6 +238,21 @@ class PaginationArea(QWidget):
         self.redraw_ui()
         self.setVisible(total_pages > 1)
 
+    def reset(self):
+        self.current_page = 0
+        self.cursors = {0 : None}
+
+    def page_request(self) -> Paged:
+        # Pages reached one step at a time resume after the last row shown, so edits made
+        # in between cannot shift or repeat rows; a page jumped to is counted from the start
+        if self.current_page in self.cursors:
+            return Paged.After(self.cursors[self.current_page], self.items_per_page)
+        return Paged.Specific(index = self.current_page + 1, size = self.items_per_page)
+
+    def page_loaded(self, next_cursor: Optional[Cursor]):
+        if next_cursor is not None:
+            self.cursors[self.current_page + 1] = next_cursor
+
     def go_to_page(self, page_index):
         self.current_page = page_index
         # Signal the TableCard to ask the database for this page
@@ -509,14 +529,16 @@ class MainBody(Card):
         self.table_view.custom_header.setSortIndicator(0, Qt.SortOrder.AscendingOrder)
         self.table_view.custom_header.blockSignals(False)
 
+        # Filled with signals blocked, as a search here would load the directory before the window shows
+        self.tool_bar.search_filter.blockSignals(True)
         self.tool_bar.search_filter.addItem(IconLoader.get('filter-dark'), 'All Fields', userData = 'ALL')
         fields_info = self.current_db.get_entry_kind().get_entry_type().get_fields()
         for col in self.current_db.get_columns():
             self.tool_bar.search_filter.addItem(IconLoader.get('filter-dark'), fields_info[col].display_name, userData = col)
+        self.tool_bar.search_filter.blockSignals(False)
 
         col_name = self.current_db.get_columns()[0]
         self.sort_state = Sorted.By(col_name, ascending = True)
-        self.fetch_data()
 
         # Toast setup
         self.toast = ToastNotification(self)
@@ -524,7 +546,7 @@ class MainBody(Card):
     def on_search_triggered(self):
         self.search_text = self.tool_bar.search_bar.text()
         self.current_page = 0
-        self.foot_bar.pagination.current_page = 0
+        self.foot_bar.pagination.reset()
         self.fetch_data()
 
     def on_page_changed(self, page_index):
@@ -582,7 +604,7 @@ class MainBody(Card):
         self.sort_state = Sorted.By(col_name, ascending)
         
         self.current_page = 0
-        self.foot_bar.pagination.current_page = 0
+        self.foot_bar.pagination.reset()
         self.fetch_data()
 
     def switch_table(self, button_id):
@@ -596,7 +618,7 @@ class MainBody(Card):
         # Reset logical state
         self.search_text = ''
         self.current_page = 0
-        self.foot_bar.pagination.current_page = 0
+        self.foot_bar.pagination.reset()
 
         match button_id:
             case 0: self.current_db = StudentDirectory
@@ -630,21 +652,23 @@ class MainBody(Card):
         # Asks the active database for exactly what needs to be shown
         where_clause = None
         if self.search_text:
-            search_str = self.search_text.lower()
             target_col = self.tool_bar.search_filter.currentData()
-            if target_col.upper() == 'ALL' or not target_col:
-                where_clause = lambda row: any(search_str in str(val).lower() for val in row.values)
-            else:
-                where_clause = lambda row: search_str in str(row.get(target_col, '')).lower()
+            if not target_col or target_col.upper() == 'ALL':
+                target_col = None
+            where_clause = Search.For(self.search_text, target_col)
 
-        total_matches = self.current_db.get_count(where = where_clause)
-        paged_request = Paged.Specific(index = self.current_page + 1, size = self.items_per_page)
+        paged_request = self.foot_bar.pagination.page_request()
 
-        records = self.current_db.get_records(
+        total_matches, records = self.current_db.query(
             where = where_clause, 
             sorted = self.sort_state, 
             paged = paged_request
         )
+        if records:
+            # Unsorted pages follow the primary key
+            primary_key = self.current_db.get_primary_key()
+            sort_column = self.sort_state.column if self.sort_state is not None else primary_key
+            self.foot_bar.pagination.page_loaded(Cursor.Of(records[-1], sort_column, primary_key))
 
         self.table_view.model.set_data(records)
         self.table_view.table.scrollToTop()